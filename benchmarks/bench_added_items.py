@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Measures how much the peak RSS grows during a plugin run handing a 5000
+item listing to the mock xbmcgui, with the ListItems kept in added_items,
+as on the command line, and without, as in Kodi. Each mode runs in a
+process of its own.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/bench_added_items.py [items]
+"""
+from __future__ import absolute_import, print_function
+
+import os
+import resource
+import subprocess
+import sys
+
+import kodiswift
+from kodiswift import Plugin
+
+
+def run(count, keep_added_items):
+    # The mock xbmcaddon reads the addon.xml of the current directory
+    os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          os.pardir, 'tests', 'data', 'plugin'))
+    plugin = Plugin('Bench', 'plugin.video.bench',
+                    keep_added_items=keep_added_items)
+    # Kodi copies the items it is given, the mock would log a warning
+    kodiswift.xbmcplugin.addDirectoryItems = lambda *args: True
+
+    @plugin.route('/')
+    def episodes():
+        return [{
+            'label': 'Episode %d' % i,
+            'path': plugin.url_for('episodes', page=str(i)),
+            'thumbnail': 'http://x/thumbs/%d.png' % i,
+            'info': {'title': 'Episode %d' % i, 'plot': 'x' * 200},
+            'properties': {'TotalTime': '1320'},
+            'is_playable': True,
+        } for i in range(count)]
+
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    sys.argv = ['plugin://plugin.video.bench/', '0', '?']
+    plugin.run()
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return after - before, len(plugin.added_items), plugin.added_items_count
+
+
+def main():
+    if len(sys.argv) > 2:
+        print('%d %d %d' % run(int(sys.argv[1]), sys.argv[2] == 'keep'))
+        return
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    print('%8s %8s %8s %15s' % ('mode', 'kept', 'added',
+                                'RSS growth (KB)'))
+    for mode in ('keep', 'drop'):
+        output = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), str(count), mode],
+            stderr=open('/dev/null', 'w'))
+        rss, kept, added = output.split()[-3:]
+        print('%8s %8s %8s %15s' % (mode, kept, added, rss))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Measures the cost of cache hits through the cached decorator, with and
+without the in memory memo, e.g. for a metadata helper called for every item
+of a listing.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/bench_cached.py [calls]
+"""
+from __future__ import absolute_import, print_function
+
+import shutil
+import sys
+import tempfile
+import timeit
+
+from kodiswift.xbmcmixin import XBMCMixin
+
+
+class Mixin(XBMCMixin):
+    def __init__(self, storage_path, memo_size):
+        self.storage_path = storage_path
+        self.memo_size = memo_size
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    temp_dir = tempfile.mkdtemp()
+    try:
+        for memo_size in (0, 256):
+            plugin = Mixin(temp_dir, memo_size)
+
+            @plugin.cached()
+            def show_info(show_id, extended=False):
+                return {'id': show_id, 'plot': 'x' * 200}
+
+            def hits():
+                for i in range(calls):
+                    show_info(i % 100, extended=True)
+
+            hits()
+            best = min(timeit.repeat(hits, number=1, repeat=5))
+            print('memo_size=%-4d %d hits %8.1f ms' % (
+                memo_size, calls, best * 1000))
+            plugin.clear_function_cache()
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
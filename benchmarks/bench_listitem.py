@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Measures the cost of turning listings of dicts into ListItems, one
+from_dict call per item, as add_items used to, compared to from_dicts, and
+of then creating their xbmcgui.ListItems with as_tuple. Also measures how
+much memory 10000 ListItems take, before and after creating their
+xbmcgui.ListItems, each in a process of its own.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/bench_listitem.py
+"""
+from __future__ import absolute_import, print_function
+
+import os
+import resource
+import subprocess
+import sys
+import timeit
+
+from kodiswift import ListItem
+
+
+def make_items(count):
+    return [{
+        'label': 'Episode %d' % i,
+        'label2': 'S01E%02d' % (i % 100),
+        'path': 'plugin://plugin.video.test/episodes/%d/' % i,
+        'icon': 'http://x/icons/%d.png' % i,
+        'thumbnail': 'http://x/thumbs/%d.png' % i,
+        'fanart': 'http://x/fanart/%d.jpg' % i,
+        'info': {'title': 'Episode %d' % i, 'episode': i, 'season': 1},
+        'properties': {'TotalTime': '1320', 'ResumeTime': '0'},
+        'stream_info': {'video': {'codec': 'h264', 'height': 720}},
+        'is_playable': True,
+        'info_type': 'video',
+    } for i in range(count)]
+
+
+def memory(count, materialize):
+    """Returns the growth of the peak RSS, in KB, from keeping count
+    ListItems.
+    """
+    items = make_items(count)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    listitems = list(ListItem.from_dicts(items))
+    if materialize:
+        for listitem in listitems:
+            listitem.as_tuple()
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+
+
+def main():
+    if len(sys.argv) > 2:
+        print(memory(int(sys.argv[1]), sys.argv[2] == 'as_tuple'))
+        return
+
+    print('%8s %14s %15s %17s' % ('items', 'from_dict (ms)', 'from_dicts (ms)',
+                                  '+ as_tuple (ms)'))
+    for count in (100, 1000, 10000):
+        items = make_items(count)
+
+        def per_item():
+            [ListItem.from_dict(**item) for item in items]
+
+        def bulk():
+            list(ListItem.from_dicts(items))
+
+        def bulk_as_tuple():
+            [item.as_tuple() for item in ListItem.from_dicts(items)]
+
+        timings = [min(timeit.repeat(func, number=3, repeat=5)) / 3
+                   for func in (per_item, bulk, bulk_as_tuple)]
+        print('%8d %14.2f %15.2f %17.2f' % (
+            count, timings[0] * 1e3, timings[1] * 1e3, timings[2] * 1e3))
+
+    print()
+    print('%8s %15s %17s' % ('items', 'ListItems (KB)', '+ as_tuple (KB)'))
+    rss = [subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), '10000', mode],
+        stderr=open(os.devnull, 'w')).split()[-1]
+        for mode in ('listitems', 'as_tuple')]
+    print('%8d %15s %17s' % (10000, rss[0], rss[1]))
+
+
+if __name__ == '__main__':
+    main()
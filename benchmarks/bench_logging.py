@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Measures the cost of cache hits through the cached decorator as they are
+logged inside Kodi: with every debug record formatted and sent to xbmc.log,
+as before, with debug records dropped by the handler before formatting, and
+with the log level above debug, as when Kodi's debug logging is off.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/bench_logging.py [calls]
+"""
+from __future__ import absolute_import, print_function
+
+import logging
+import shutil
+import sys
+import tempfile
+import timeit
+
+import kodiswift
+from kodiswift import logger
+from kodiswift.xbmcmixin import XBMCMixin
+
+
+class Mixin(XBMCMixin):
+    memo_size = 0
+
+    def __init__(self, storage_path):
+        self.storage_path = storage_path
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    # Pretend to run inside Kodi, which writes the messages to its log
+    logger.CLI_MODE = False
+    kodiswift.xbmc.log = lambda msg, level=0: None
+    # The kodiswift log was set up for the CLI on import, give it the
+    # handler setup_log adds inside Kodi instead
+    log = logging.getLogger('kodiswift')
+    for handler in list(log.handlers):
+        log.removeHandler(handler)
+    log.addHandler(logger.XBMCHandler('[kodiswift] '))
+    log.propagate = False
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        plugin = Mixin(temp_dir)
+
+        @plugin.cached()
+        def show_info(show_id, extended=False):
+            return {'id': show_id, 'plot': 'x' * 200}
+
+        def hits():
+            for i in range(calls):
+                show_info(i % 100, extended=True)
+
+        hits()
+        print('%-36s %12s' % ('mode', 'us per hit'))
+        for mode, level, kodi_debug in (
+                ('debug, sent to xbmc.log', logging.DEBUG, True),
+                ('debug, dropped by the handler', logging.DEBUG, False),
+                ('info (Kodi debug logging off)', logging.INFO, False)):
+            logger.set_log_level(level)
+            logger._kodi_debug = kodi_debug
+            best = min(timeit.repeat(hits, number=1, repeat=5))
+            print('%-36s %12.2f' % (mode, best / calls * 1e6))
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
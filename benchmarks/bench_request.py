@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Measures the cost of constructing a Request for query strings carrying
+pickled payloads of growing size, when the view reads a single small
+argument, compared to parsing and unpickling the whole query string up
+front.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/bench_request.py
+"""
+from __future__ import absolute_import, print_function
+
+import timeit
+import urllib
+import urlparse
+
+from kodiswift.common import pickle_dict, unpickle_args
+from kodiswift.request import Request
+
+
+def eager_request(url):
+    """The Request.args parsing prior to the lazy arguments."""
+    query_string = url.split('?', 1)[1]
+    return unpickle_args(urlparse.parse_qs(query_string))
+
+
+def main():
+    print('%8s %8s %14s %14s' % ('items', 'url len', 'eager (us)',
+                                 'lazy (us)'))
+    for count in (1, 10, 100, 1000):
+        payload = [{'label': 'Stream %d' % i, 'url': 'http://x/%d.m3u8' % i,
+                    'bitrate': i * 1000} for i in range(count)]
+        qs = urllib.urlencode(pickle_dict({'page': '2', 'streams': payload}))
+        url = 'plugin://plugin.video.test/shows/?' + qs
+
+        def eager():
+            eager_request(url)['page']
+
+        def lazy():
+            Request(url, '0').args['page']
+
+        timings = [min(timeit.repeat(func, number=100, repeat=5)) / 100
+                   for func in (eager, lazy)]
+        print('%8d %8d %14.1f %14.1f' % (
+            count, len(url), timings[0] * 1e6, timings[1] * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Compares opening a large catalog and reading one key from a pickled
+TimedStorage, which is loaded in full, and from a SnapshotStorage built from
+it, which is memory mapped.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/bench_snapshot_storage.py [genres]
+"""
+from __future__ import absolute_import, print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+from kodiswift.storage import SnapshotStorage, TimedStorage
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    temp_dir = tempfile.mkdtemp()
+    try:
+        source_path = os.path.join(temp_dir, 'catalog')
+        snapshot_path = os.path.join(temp_dir, 'catalog.snapshot')
+        storage = TimedStorage(source_path)
+        for i in range(count):
+            storage['genre %d' % i] = [
+                {'label': 'Show %d' % j, 'path': '/shows/%d/%d/' % (i, j),
+                 'info': {'plot': 'x' * 100}} for j in range(50)]
+        storage.close()
+        SnapshotStorage.build(snapshot_path, source_path)
+        key = 'genre %d' % (count // 2)
+
+        def timed_storage():
+            storage = TimedStorage(source_path)
+            storage.load()
+            return storage[key]
+
+        def snapshot_storage():
+            storage = SnapshotStorage(snapshot_path)
+            storage.load()
+            value = storage[key]
+            storage.close()
+            return value
+
+        print('%d genres, pickle %.1f MB, snapshot %.1f MB' % (
+            count, os.path.getsize(source_path) / 1e6,
+            os.path.getsize(snapshot_path) / 1e6))
+        for name, func in (('TimedStorage', timed_storage),
+                           ('SnapshotStorage', snapshot_storage)):
+            best = min(timeit.repeat(func, number=1, repeat=5))
+            print('%-16s open + 1 lookup %9.3f ms' % (name, best * 1000))
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Compares the load and sync times and the file sizes of the storage formats
+on a synthetic store of listing dicts, like the ones cached by
+``plugin.cached_route``.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/bench_storage_formats.py [entries]
+"""
+from __future__ import absolute_import, print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+
+from kodiswift.storage import Formats, TimedStorage
+
+
+def make_entries(count):
+    now = time.time()
+    entries = {}
+    for i in range(count):
+        item = {
+            'label': 'Episode %d' % i,
+            'path': 'plugin://plugin.video.bench/play/%d/' % i,
+            'thumbnail': 'http://example.com/thumbs/%d.jpg' % i,
+            'is_playable': True,
+            'info': {'plot': 'An episode ' * 10, 'year': 2000 + i % 20,
+                     'rating': 7.5},
+            'properties': {'fanart_image': 'http://example.com/%d.jpg' % i},
+        }
+        entries['/shows/%d/episodes/' % i] = ([item], now)
+    return entries
+
+
+def bench(file_format, entries, temp_dir, repeat=5):
+    file_path = os.path.join(temp_dir, file_format)
+    storage = TimedStorage(file_path, file_format=file_format)
+    storage._store = entries
+
+    def sync():
+        storage._dirty = True
+        storage.sync()
+
+    def load():
+        TimedStorage(file_path, file_format=file_format).load()
+
+    sync_time = min(timeit.repeat(sync, number=1, repeat=repeat))
+    load_time = min(timeit.repeat(load, number=1, repeat=repeat))
+    return sync_time, load_time, os.path.getsize(file_path)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    entries = make_entries(count)
+    temp_dir = tempfile.mkdtemp()
+    try:
+        print('%d entries' % count)
+        print('%-8s %10s %10s %12s' % ('format', 'sync (ms)', 'load (ms)',
+                                       'size (KiB)'))
+        for file_format in (Formats.PICKLE, Formats.JSON, Formats.MARSHAL):
+            sync_time, load_time, size = bench(file_format, entries, temp_dir)
+            print('%-8s %10.1f %10.1f %12.1f' % (
+                file_format, sync_time * 1000, load_time * 1000,
+                size / 1024.0))
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
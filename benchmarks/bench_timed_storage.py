@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Measures the cost of the TTL check in TimedStorage by iterating over the
+items of a large store, compared to the datetime based check it replaced.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/bench_timed_storage.py [entries]
+"""
+from __future__ import absolute_import, print_function
+
+import sys
+import time
+import timeit
+from datetime import datetime, timedelta
+
+from kodiswift.storage import TimedStorage
+
+
+def datetime_items(storage):
+    """The TimedStorage.items() implementation prior to the float TTL."""
+    items = []
+    for k in storage._store.keys():
+        val, timestamp = storage._store[k]
+        ttl_diff = datetime.utcnow() - datetime.utcfromtimestamp(timestamp)
+        if storage.ttl and ttl_diff > storage.ttl:
+            continue
+        items.append((k, val))
+    return items
+
+
+def datetime_getitem(storage, item):
+    """The TimedStorage.__getitem__ TTL check prior to the float TTL."""
+    val, timestamp = storage._store[item]
+    ttl_diff = datetime.utcnow() - datetime.utcfromtimestamp(timestamp)
+    if storage.ttl and ttl_diff > storage.ttl:
+        raise KeyError
+    return val
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    storage = TimedStorage('/dev/null', timedelta(hours=1))
+    now = time.time()
+    storage._store = dict(('/videos/%d/' % i, ('Video %d' % i, now))
+                          for i in range(count))
+
+    def datetime_lookups():
+        for key in storage._store.keys():
+            datetime_getitem(storage, key)
+
+    def lookups():
+        for key in storage._store.keys():
+            storage[key]
+
+    results = (
+        ('items() datetime', lambda: datetime_items(storage)),
+        ('items()', storage.items),
+        ('__getitem__ datetime', datetime_lookups),
+        ('__getitem__', lookups),
+        ('purge_expired()', storage.purge_expired),
+    )
+    print('%d entries' % count)
+    for name, func in results:
+        best = min(timeit.repeat(func, number=1, repeat=5))
+        print('%-24s %8.1f ms' % (name, best * 1000))
+
+
+if __name__ == '__main__':
+    main()
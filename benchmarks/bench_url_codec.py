@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+Compares the pickle and JSON url argument codecs on representative url_for
+payloads: the length of the query string, and the time to encode it and to
+decode it back.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/bench_url_codec.py
+"""
+from __future__ import absolute_import, print_function
+
+import timeit
+import urllib
+
+from kodiswift.common import JSONCodec, PickleCodec, encode_dict
+from kodiswift.request import Request
+
+PAYLOADS = (
+    ('page number', {'page': 2}),
+    ('id list', {'ids': range(1000, 1020)}),
+    ('info dict', {'info': {'title': 'Show', 'year': 2016, 'rating': 7.5,
+                            'genre': ['Drama', 'Crime'],
+                            'plot': 'A plot summary of the show. ' * 5}}),
+    ('streams', {'streams': [
+        {'label': '%dp' % height, 'bitrate': height * 3000,
+         'url': 'http://cdn.example.com/show/s01e01/%d/index.m3u8' % height}
+        for height in (240, 360, 480, 720, 1080)]}),
+)
+
+
+def main():
+    print('%-12s %-7s %8s %11s %11s' % ('payload', 'codec', 'qs len',
+                                        'encode us', 'decode us'))
+    for name, items in PAYLOADS:
+        for codec in (PickleCodec(), JSONCodec()):
+            qs = urllib.urlencode(encode_dict(items, codec))
+            url = 'plugin://plugin.video.test/?' + qs
+            key = list(items)[0]
+
+            def encode():
+                urllib.urlencode(encode_dict(items, codec))
+
+            def decode():
+                Request(url, '0').args[key]
+
+            timings = [min(timeit.repeat(func, number=200, repeat=5)) / 200
+                       for func in (encode, decode)]
+            print('%-12s %-7s %8d %11.1f %11.1f' % (
+                name, codec.__class__.__name__[:-5], len(qs),
+                timings[0] * 1e6, timings[1] * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -73,7 +73,7 @@ except ImportError:
 from kodiswift.storage import TimedStorage
 from kodiswift.request import Request
 from kodiswift.common import (kodi_url, clean_dict, pickle_dict, unpickle_args,
-                              unpickle_dict, download_page)
+                              unpickle_dict, download_page, cache_key)
 from kodiswift.constants import SortMethod
 from kodiswift.listitem import ListItem
 from kodiswift.logger import setup_log
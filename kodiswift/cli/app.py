@@ -62,12 +62,10 @@ class RunCommand(object):
 def setup_options(opts):
     """Takes any actions necessary based on command line options"""
     if opts.quiet:
-        logger.log.setLevel(logging.WARNING)
-        logger.GLOBAL_LOG_LEVEL = logging.WARNING
+        logger.set_log_level(logging.WARNING)
 
     if opts.verbose:
-        logger.log.setLevel(logging.DEBUG)
-        logger.GLOBAL_LOG_LEVEL = logging.DEBUG
+        logger.set_log_level(logging.DEBUG)
 
 
 def get_addon_module_name(addon_xml_filename):
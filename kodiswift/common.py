@@ -10,15 +10,29 @@ This module contains some common helpful functions.
 """
 from __future__ import absolute_import
 
+import base64
+import errno
+import hashlib
+import json
+import os
+import time
 import urllib
+import zlib
 
 try:
     import cPickle as pickle
 except ImportError:
     import pickle
 
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
 __all__ = ['clean_dict', 'kodi_url', 'unpickle_args', 'pickle_dict',
-           'unpickle_dict', 'download_page', 'Modes']
+           'unpickle_dict', 'encode_dict', 'decode_dict', 'PickleCodec',
+           'JSONCodec', 'URLStash', 'register_url_codec', 'download_page',
+           'cache_key', 'key_digest', 'Modes']
 
 
 class Modes(object):
@@ -129,6 +143,309 @@ def unpickle_dict(items):
     return ret
 
 
+class PickleCodec(object):
+    """Encodes url arguments with pickle, like :func:`pickle_dict`. Only use
+    it for URLs built by older versions, as unpickling a URL can run
+    arbitrary code.
+    """
+    #: The query string key listing the arguments encoded by this codec
+    marker = '_pickled'
+
+    @staticmethod
+    def dumps(value):
+        return pickle.dumps(value)
+
+    @staticmethod
+    def loads(data):
+        return pickle.loads(data)
+
+
+class JSONCodec(object):
+    """Encodes url arguments as JSON, tagging the tuples, sets and dicts with
+    keys which aren't strings that JSON has no type for. JSON of at least
+    compress_min bytes is compressed with zlib and base64url encoded when
+    that is shorter than quoting it. Strings come back as unicode.
+    """
+    marker = '_json'
+    #: JSON shorter than this is never compressed
+    compress_min = 64
+    #: The most bytes a compressed value may decompress to
+    max_size = 1024 * 1024
+
+    _TAGS = ('__t', '__s', '__f', '__d')
+
+    def _tag(self, obj):
+        if isinstance(obj, dict):
+            if (all(isinstance(k, basestring) for k in obj) and
+                    not (len(obj) == 1 and next(iter(obj)) in self._TAGS)):
+                return dict((k, self._tag(v)) for k, v in obj.items())
+            return {'__d': [[self._tag(k), self._tag(v)]
+                            for k, v in obj.items()]}
+        if isinstance(obj, list):
+            return [self._tag(v) for v in obj]
+        if isinstance(obj, tuple):
+            return {'__t': [self._tag(v) for v in obj]}
+        if isinstance(obj, frozenset):
+            return {'__f': [self._tag(v) for v in obj]}
+        if isinstance(obj, set):
+            return {'__s': [self._tag(v) for v in obj]}
+        return obj
+
+    def _untag(self, obj):
+        """The object_hook for json.loads."""
+        if len(obj) == 1:
+            tag, value = next(iter(obj.items()))
+            if tag == '__t':
+                return tuple(value)
+            elif tag == '__s':
+                return set(value)
+            elif tag == '__f':
+                return frozenset(value)
+            elif tag == '__d':
+                return dict((k, v) for k, v in value)
+        return obj
+
+    def dumps(self, value):
+        data = json.dumps(self._tag(value), separators=(',', ':'))
+        if len(data) >= self.compress_min:
+            packed = base64.urlsafe_b64encode(zlib.compress(data, 9))
+            packed = packed.rstrip('=')
+            if len(packed) < len(urllib.quote_plus(data)):
+                return 'z' + packed
+        return 'j' + data
+
+    def loads(self, data):
+        kind, data = data[:1], data[1:]
+        if kind == 'z':
+            decompressor = zlib.decompressobj()
+            data = decompressor.decompress(
+                base64.urlsafe_b64decode(data + '=' * (-len(data) % 4)),
+                self.max_size)
+            if decompressor.unconsumed_tail:
+                raise ValueError('Compressed value is too large')
+        elif kind != 'j':
+            raise ValueError('Unknown encoding %r' % kind)
+        return json.loads(data, object_hook=self._untag)
+
+
+class URLStash(object):
+    """Keeps url argument values which are too large for a URL in files,
+    named after the sha1 of their contents, and puts the name in the URL
+    instead. A stashed value is decoded with the codec it was encoded with.
+    """
+    marker = '_stash'
+
+    def __init__(self, path, min_size=1024):
+        """
+        Args:
+            path (str): The directory of the stash.
+            min_size (int): The size from which encoded values are stashed.
+        """
+        self.path = path
+        self.min_size = min_size
+
+    def put(self, marker, data):
+        """Stashes a value encoded by the codec with the given marker, or a
+        string if the marker is empty.
+
+        Returns:
+            str: The token to put in the URL.
+        """
+        contents = marker + '\n' + data
+        token = hashlib.sha1(contents).hexdigest()
+        path = os.path.join(self.path, token)
+        if os.path.exists(path):
+            # Keep it from expiring while URLs still refer to it
+            os.utime(path, None)
+            return token
+        try:
+            os.makedirs(self.path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        temp_file = path + '.tmp'
+        with open(temp_file, 'wb') as f:
+            f.write(contents)
+        os.rename(temp_file, path)
+        return token
+
+    def loads(self, token):
+        """Returns the value stashed under token.
+
+        Raises:
+            ValueError: If the token is invalid.
+            IOError: If there is no such value, e.g. because it expired.
+        """
+        if len(token) != 40 or token.strip('0123456789abcdef'):
+            raise ValueError('Invalid stash token %r' % token)
+        path = os.path.join(self.path, token)
+        with open(path, 'rb') as f:
+            marker, _, data = f.read().partition('\n')
+        os.utime(path, None)
+        if not marker:
+            return data
+        return url_codecs[marker].loads(data)
+
+    def sweep(self, max_age):
+        """Removes the values which weren't stashed or read for max_age
+        seconds.
+
+        Returns:
+            int: The number of values removed.
+        """
+        if not os.path.isdir(self.path):
+            return 0
+        cutoff = time.time() - max_age
+        removed = 0
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                # Removed by another process
+                pass
+        return removed
+
+
+#: The codecs which url arguments are decoded with, by marker
+url_codecs = {}
+
+
+def register_url_codec(codec):
+    """Registers a codec for decoding url arguments. Custom codecs need a
+    marker attribute naming the query string key which lists the arguments
+    they encoded, and dumps and loads methods. The arguments of a request
+    are decoded with the registered codec whose marker they carry.
+    """
+    url_codecs[codec.marker] = codec
+
+
+register_url_codec(PickleCodec())
+register_url_codec(JSONCodec())
+
+
+def encode_dict(items, codec=None, stash=None):
+    """Encodes the values of `items` which aren't strings with a codec.
+
+    Args:
+        items (dict): A dictionary
+        codec (Optional[object]): A registered codec, by default a
+            :class:`JSONCodec`. Values it can't encode fall back to the
+            :class:`PickleCodec`.
+        stash (Optional[URLStash]): If given, values which are at least
+            stash.min_size bytes once encoded are stashed.
+
+    Returns:
+        dict: Values which aren't instances of basestring are encoded. Keys
+            named after the marker of each codec used contain a comma
+            separated list of the keys they encoded.
+    """
+    codec = codec or url_codecs[JSONCodec.marker]
+    fallback = url_codecs[PickleCodec.marker]
+    ret = {}
+    encoded = {}
+    for k, v in items.items():
+        if isinstance(v, basestring):
+            if stash is None or len(v) < stash.min_size:
+                ret[k] = v
+                continue
+            marker, data = '', v
+        else:
+            try:
+                marker, data = codec.marker, codec.dumps(v)
+            except (TypeError, ValueError, UnicodeError):
+                marker, data = fallback.marker, fallback.dumps(v)
+        if stash is not None and len(data) >= stash.min_size:
+            if isinstance(data, unicode):
+                data = data.encode('utf-8')
+            marker, data = stash.marker, stash.put(marker, data)
+        ret[k] = data
+        encoded.setdefault(marker, []).append(k)
+    for marker, keys in encoded.items():
+        ret[marker] = ','.join(keys)
+    return ret
+
+
+def decode_dict(items):
+    """Decodes a dictionary encoded with :func:`encode_dict` or
+    :func:`pickle_dict`.
+
+    Args:
+        items (dict): An encoded dictionary.
+
+    Returns:
+        dict: A decoded dictionary.
+    """
+    ret = dict(items)
+    for marker, codec in url_codecs.items():
+        if marker not in ret:
+            continue
+        for k in ret.pop(marker).split(','):
+            if k in ret:
+                ret[k] = codec.loads(ret[k])
+    return ret
+
+
+def _canonical(obj):
+    """Returns obj with its dicts and sets replaced by sorted lists of their
+    items, tagged with their type, so equal objects pickle the same.
+    """
+    if isinstance(obj, dict):
+        return dict, sorted((_canonical(k), _canonical(v))
+                            for k, v in obj.items())
+    if isinstance(obj, (set, frozenset)):
+        return type(obj), sorted(_canonical(v) for v in obj)
+    if isinstance(obj, list):
+        return [_canonical(v) for v in obj]
+    if isinstance(obj, tuple):
+        return tuple(_canonical(v) for v in obj)
+    return obj
+
+
+def _key_bytes(obj):
+    """Pickles obj so that equal objects give the same bytes."""
+    f = StringIO()
+    # The memo would make equal objects pickle differently depending on
+    # which of their objects are shared
+    pickler = pickle.Pickler(f, 2)
+    pickler.fast = 1
+    pickler.dump(_canonical(obj))
+    return f.getvalue()
+
+
+def cache_key(function, args, kwargs):
+    """The default key function of :meth:`kodiswift.Plugin.cached`.
+
+    Args:
+        function (callable): The cached function.
+        args (tuple): The positional arguments it is called with.
+        kwargs (dict): The keyword arguments it is called with.
+
+    Returns:
+        str: A sha1 hex digest of the module and name of the function and of
+            its arguments. Equal dicts and sets give the same digest no
+            matter their order.
+    """
+    name = '%s.%s' % (function.__module__, function.__name__)
+    return hashlib.sha1(name + '\0' + _key_bytes((args, kwargs))).hexdigest()
+
+
+def key_digest(key):
+    """Returns a sha1 hex digest of a cache key, such as one returned by a
+    key_func of :meth:`kodiswift.Plugin.cached`. Equal keys give the same
+    digest in every process.
+
+    Args:
+        key: A picklable key.
+
+    Returns:
+        str: The digest.
+    """
+    return hashlib.sha1(_key_bytes(key)).hexdigest()
+
+
 def download_page(url, data=None):
     """Returns the response for the given url. The optional data argument is
     passed directly to urlopen.
@@ -21,22 +21,37 @@ __all__ = ['ListItem']
 class ListItem(object):
     """A wrapper for the xbmcgui.ListItem class. The class keeps track
     of any set properties that xbmcgui doesn't expose getters for.
+
+    The xbmcgui.ListItem is only created when it is needed, by
+    :meth:`as_tuple` or :meth:`as_xbmc_listitem`, so items which never
+    reach Kodi don't pay for one. From then on, changes to the ListItem
+    are also made to the xbmcgui.ListItem.
     """
 
+    __slots__ = ('_listitem', '_label', '_label2', '_path', '_art', '_info',
+                 '_properties', '_stream_info', '_context_menu_items',
+                 '_replace_context_menu', '_selected', '_played', '_playable',
+                 'is_folder')
+
     def __init__(self, label=None, label2=None, icon=None, thumbnail=None,
                  path=None):
         """Defaults are an emtpy string since xbmcgui.ListItem will not
         accept None.
         """
-        self._listitem = xbmcgui.ListItem(label=label, label2=label2, path=path)
+        self._listitem = None
+        self._label = label
+        self._label2 = label2
+        self._path = path
 
         # The docs have the thumbnail property set as thumb
         # http://mirrors.kodi.tv/docs/python-docs/16.x-jarvis/xbmcgui.html#ListItem-setArt
         self._art = {'icon': icon, 'thumb': thumbnail}
-        self._icon = icon
-        self._path = path
-        self._thumbnail = thumbnail
+        self._info = []
+        self._properties = {}
+        self._stream_info = []
         self._context_menu_items = []
+        self._replace_context_menu = False
+        self._selected = False
         self._played = False
         self._playable = False
         self.is_folder = True
@@ -54,8 +69,10 @@ class ListItem(object):
             assert isinstance(action, basestring)
         if replace_items:
             self._context_menu_items = []
+            self._replace_context_menu = True
         self._context_menu_items.extend(items)
-        self._listitem.addContextMenuItems(items, replace_items)
+        if self._listitem is not None:
+            self._listitem.addContextMenuItems(items, replace_items)
 
     @property
     def label(self):
@@ -63,7 +80,7 @@ class ListItem(object):
         Returns:
             str:
         """
-        return self._listitem.getLabel()
+        return self._label
 
     @label.setter
     def label(self, value):
@@ -71,7 +88,9 @@ class ListItem(object):
         Args:
             value (str):
         """
-        self._listitem.setLabel(value)
+        self._label = value
+        if self._listitem is not None:
+            self._listitem.setLabel(value)
 
     def get_label(self):
         warnings.warn('get_label is deprecated, use label property',
@@ -81,15 +100,17 @@ class ListItem(object):
     def set_label(self, value):
         warnings.warn('set_label is deprecated, use label property',
                       DeprecationWarning)
-        return self._listitem.setLabel(value)
+        self.label = value
 
     @property
     def label2(self):
-        return self._listitem.getLabel2()
+        return self._label2
 
     @label2.setter
     def label2(self, value):
-        self._listitem.setLabel2(value)
+        self._label2 = value
+        if self._listitem is not None:
+            self._listitem.setLabel2(value)
 
     def get_label2(self):
         warnings.warn('get_label2 is deprecated, use label2 property',
@@ -99,25 +120,27 @@ class ListItem(object):
     def set_label2(self, value):
         warnings.warn('set_label2 is deprecated, use label2 property',
                       DeprecationWarning)
-        return self._listitem.setLabel2(value)
+        self.label2 = value
 
     @property
     def selected(self):
-        return self._listitem.isSelected()
+        return self._selected
 
     @selected.setter
     def selected(self, value):
-        self._listitem.select(value)
+        self._selected = value
+        if self._listitem is not None:
+            self._listitem.select(value)
 
     def is_selected(self):
         warnings.warn('is_selected is deprecated, use selected property',
                       DeprecationWarning)
-        return self._listitem.isSelected()
+        return self.selected
 
     def select(self, selected_status=True):
         warnings.warn('select is deprecated, use selected property',
                       DeprecationWarning)
-        return self._listitem.select(selected_status)
+        self.selected = selected_status
 
     @property
     def icon(self):
@@ -126,7 +149,7 @@ class ListItem(object):
     @icon.setter
     def icon(self, value):
         self._art['icon'] = value
-        self._listitem.setArt(self._art)
+        self.art = self._art
 
     def get_icon(self):
         warnings.warn('get_icon is deprecated, use icon property',
@@ -146,7 +169,7 @@ class ListItem(object):
     @thumbnail.setter
     def thumbnail(self, value):
         self._art['thumb'] = value
-        self._listitem.setArt(self._art)
+        self.art = self._art
 
     def get_thumbnail(self):
         warnings.warn('get_thumbnail is deprecated, use thumbnail property',
@@ -166,7 +189,7 @@ class ListItem(object):
     @poster.setter
     def poster(self, value):
         self._art['poster'] = value
-        self._listitem.setArt(self._art)
+        self.art = self._art
 
     @property
     def path(self):
@@ -175,7 +198,8 @@ class ListItem(object):
     @path.setter
     def path(self, value):
         self._path = value
-        self._listitem.setPath(value)
+        if self._listitem is not None:
+            self._listitem.setPath(value)
 
     def get_path(self):
         warnings.warn('get_path is deprecated, use path property',
@@ -185,8 +209,7 @@ class ListItem(object):
     def set_path(self, path):
         warnings.warn('set_path is deprecated, use path property',
                       DeprecationWarning)
-        self._path = path
-        return self._listitem.setPath(path)
+        self.path = path
 
     @property
     def playable(self):
@@ -244,38 +267,75 @@ class ListItem(object):
     @art.setter
     def art(self, value):
         self._art = value
-        self._listitem.setArt(value)
+        if self._listitem is not None:
+            self._listitem.setArt(value)
 
     def set_art(self, value):
-        self._art = value
-        self._listitem.setArt(value)
+        self.art = value
 
     def set_info(self, info_type, info_labels):
         """Sets the listitem's info"""
-        return self._listitem.setInfo(info_type, info_labels)
+        self._info.append((info_type, info_labels))
+        if self._listitem is not None:
+            return self._listitem.setInfo(info_type, info_labels)
 
     def get_property(self, key):
-        """Returns the property associated with the given key"""
-        return self._listitem.getProperty(key)
+        """Returns the property associated with the given key. Like
+        Kodi, keys aren't case sensitive and missing keys return ''.
+        """
+        return self._properties.get(key.lower(), '')
 
     def set_property(self, key, value):
         """Sets a property for the given key and value"""
-        return self._listitem.setProperty(key, value)
+        self._properties[key.lower()] = value
+        if self._listitem is not None:
+            return self._listitem.setProperty(key, value)
 
     def add_stream_info(self, stream_type, stream_values):
         """Adds stream details"""
-        return self._listitem.addStreamInfo(stream_type, stream_values)
+        self._stream_info.append((stream_type, stream_values))
+        if self._listitem is not None:
+            return self._listitem.addStreamInfo(stream_type, stream_values)
 
     def as_tuple(self):
         """Returns a tuple of list item properties:
             (path, the wrapped xbmcgui.ListItem, is_folder)
         """
-        return self.path, self._listitem, self.is_folder
+        return self._path, self.as_xbmc_listitem(), self.is_folder
 
     def as_xbmc_listitem(self):
-        """Returns the wrapped xbmcgui.ListItem"""
+        """Returns the wrapped xbmcgui.ListItem, creating it the first
+        time.
+        """
+        if self._listitem is None:
+            self._listitem = self._build_listitem()
         return self._listitem
 
+    def _build_listitem(self):
+        """Returns a new xbmcgui.ListItem with the state of this ListItem,
+        given with one call per kind of state.
+        """
+        listitem = xbmcgui.ListItem(label=self._label, label2=self._label2,
+                                    path=self._path)
+        listitem.setArt(self._art)
+        if self._selected:
+            listitem.select(self._selected)
+        for info_type, info_labels in self._info:
+            listitem.setInfo(info_type, info_labels)
+        if self._properties:
+            # setProperties is only available from Kodi 18
+            if hasattr(listitem, 'setProperties'):
+                listitem.setProperties(self._properties)
+            else:
+                for key, val in self._properties.items():
+                    listitem.setProperty(key, val)
+        for stream_type, stream_values in self._stream_info:
+            listitem.addStreamInfo(stream_type, stream_values)
+        if self._context_menu_items:
+            listitem.addContextMenuItems(self._context_menu_items,
+                                         self._replace_context_menu)
+        return listitem
+
     @classmethod
     def from_dict(cls, label=None, label2=None, icon=None, thumbnail=None,
                   path=None, selected=None, info=None, properties=None,
@@ -323,6 +383,73 @@ class ListItem(object):
 
         return listitem
 
+    @classmethod
+    def from_dicts(cls, items, info_type='video'):
+        """Yields a ListItem for each dict in items, as if by calling
+        from_dict with it.
+
+        Used to build large listings: the state of each ListItem is
+        filled in directly, without going through its setters. Items
+        which are already ListItems are yielded unchanged.
+
+        Args:
+            items (Iterable[Union[dict, ListItem]]): The items to convert.
+            info_type (str): The info_type of the dicts which have none.
+        """
+        for item in items:
+            if hasattr(item, 'as_tuple') or not hasattr(item, 'keys'):
+                yield item
+                continue
+
+            get = item.get
+            listitem = cls.__new__(cls)
+            listitem._listitem = None
+            listitem._label = get('label')
+            listitem._label2 = get('label2')
+            listitem._path = get('path')
+            listitem._art = {
+                'icon': get('icon'),
+                'thumb': get('thumbnail'),
+                'poster': get('poster'),
+                'banner': get('banner'),
+                'fanart': get('fanart'),
+                'landscape': get('landscape'),
+            }
+            listitem._selected = get('selected') or False
+            listitem._played = False
+
+            info = get('info')
+            listitem._info = [(get('info_type', info_type), info)] if info \
+                else []
+
+            properties = {}
+            if get('is_playable'):
+                listitem._playable = True
+                listitem.is_folder = False
+                properties['isplayable'] = 'true'
+            else:
+                listitem._playable = False
+                listitem.is_folder = True
+            if get('properties'):
+                _properties = item['properties']
+                if hasattr(_properties, 'items'):
+                    _properties = _properties.items()
+                for key, val in _properties:
+                    properties[key.lower()] = val
+            listitem._properties = properties
+
+            stream_info = get('stream_info')
+            listitem._stream_info = stream_info.items() if stream_info else []
+
+            listitem._context_menu_items = []
+            listitem._replace_context_menu = False
+            context_menu = get('context_menu')
+            if context_menu:
+                listitem.add_context_menu_items(
+                    context_menu, get('replace_context_menu', False))
+
+            yield listitem
+
     def __eq__(self, other):
         if not isinstance(other, ListItem):
             raise NotImplementedError
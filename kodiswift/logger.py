@@ -11,11 +11,12 @@ method for creating new loggers.
 """
 from __future__ import absolute_import
 
+import json
 import logging
 
 from kodiswift import CLI_MODE
 
-__all__ = ['setup_log', 'GLOBAL_LOG_LEVEL', 'log']
+__all__ = ['setup_log', 'set_log_level', 'GLOBAL_LOG_LEVEL', 'log']
 
 # TODO: Add logging to a file as well when on CLI with lowest threshold
 #       possible
@@ -23,13 +24,15 @@ __all__ = ['setup_log', 'GLOBAL_LOG_LEVEL', 'log']
 # fh.setLevel(logging.DEBUG)
 # fh.setFormatter(formatter)
 # log.addHandler(fh)
-# TODO: Allow a global flag to set logging level when dealing with Kodi
 # TODO: Add -q and -v flags to CLI to quiet or enable more verbose logging
 
 
 class XBMCFilter(object):
     """A logging filter that streams to STDOUT or to the xbmc log if
     running inside Kodi.
+
+    setup_log uses an :class:`XBMCHandler` instead, this filter is kept
+    for loggers set up by hand.
     """
     python_to_xbmc = {
         'DEBUG': 'LOGDEBUG',
@@ -58,7 +61,8 @@ class XBMCFilter(object):
         True.
 
         When running inside Kodi it calls the xbmc.log() method and prevents
-        the message from being double printed to STDOUT.
+        the message from being double printed to STDOUT. Debug records are
+        dropped without being formatted unless Kodi's debug logging is on.
         """
 
         # When running in Kodi, any logged statements will be double printed
@@ -66,6 +70,8 @@ class XBMCFilter(object):
         # so every log message is filtered out and not printed again.
         if CLI_MODE:
             return True
+        elif record.levelno < logging.INFO and not kodi_debug_enabled():
+            return False
         else:
             # Must not be imported until here because of import order issues
             # when running in CLI
@@ -76,10 +82,96 @@ class XBMCFilter(object):
             return False
 
 
+class XBMCHandler(logging.Handler):
+    """A logging handler which sends records to the xbmc log when running
+    inside Kodi. Debug records are dropped without being formatted unless
+    Kodi's debug logging is on.
+    """
+
+    def __init__(self, prefix):
+        logging.Handler.__init__(self)
+        self.prefix = prefix
+
+    def handle(self, record):
+        # xbmc.log is thread safe, so unlike logging.Handler no lock is taken
+        rv = self.filter(record)
+        if rv:
+            self.emit(record)
+        return rv
+
+    def emit(self, record):
+        if record.levelno < logging.INFO and not kodi_debug_enabled():
+            return
+        # Must not be imported until here because of import order issues
+        # when running in CLI
+        from kodiswift import xbmc
+        xbmc_level = XBMCFilter.xbmc_levels.get(
+            XBMCFilter.python_to_xbmc.get(record.levelname))
+        try:
+            if self.formatter is None and not record.exc_info:
+                message = record.getMessage()
+            else:
+                message = self.format(record)
+            xbmc.log('%s%s' % (self.prefix, message), xbmc_level)
+        except Exception:
+            self.handleError(record)
+
+
+_kodi_debug = None
+
+
+def kodi_debug_enabled():
+    """Returns whether Kodi's debug logging is on. Kodi is only asked the
+    first time, the answer is kept for the rest of the process. Returns
+    True if Kodi can't tell.
+    """
+    global _kodi_debug
+    if _kodi_debug is None:
+        # Must not be imported until here because of import order issues
+        # when running in CLI
+        from kodiswift import xbmc
+        request = {
+            'jsonrpc': '2.0',
+            'id': 1,
+            'method': 'Settings.GetSettingValue',
+            'params': {'setting': 'debug.showloginfo'},
+        }
+        try:
+            response = json.loads(xbmc.executeJSONRPC(json.dumps(request)))
+            _kodi_debug = bool(response['result']['value'])
+        except (KeyError, TypeError, ValueError):
+            _kodi_debug = True
+    return _kodi_debug
+
+
+# The names of the loggers set up by setup_log
+_log_names = set()
+
 if CLI_MODE:
     GLOBAL_LOG_LEVEL = logging.INFO
-else:
+elif kodi_debug_enabled():
     GLOBAL_LOG_LEVEL = logging.DEBUG
+else:
+    GLOBAL_LOG_LEVEL = logging.INFO
+
+
+def set_log_level(level):
+    """Sets the level of the kodiswift log and of every log set up by
+    :func:`setup_log`, including the ones set up later.
+
+    Inside Kodi, the level defaults to DEBUG if Kodi's debug logging is
+    on, else INFO. Debug calls on hot paths are skipped below DEBUG.
+
+    Args:
+        level (Union[int, str]): A logging level, e.g. logging.WARNING
+            or 'WARNING'.
+    """
+    global GLOBAL_LOG_LEVEL
+    if isinstance(level, basestring):
+        level = logging.getLevelName(level.upper())
+    GLOBAL_LOG_LEVEL = level
+    for name in _log_names:
+        logging.getLogger(name).setLevel(level)
 
 
 def setup_log(name):
@@ -87,15 +179,25 @@ def setup_log(name):
     object is an instance of logging.Logger. Logged messages will be
     printed to stderr when running in the CLI, or forwarded to Kodi's
     log when running in Kodi mode.
+
+    The handler is only added the first time a name is set up, so every
+    Plugin or Module instance using the name shares it.
     """
     _log = logging.getLogger(name)
     _log.setLevel(GLOBAL_LOG_LEVEL)
-    handler = logging.StreamHandler()
-    formatter = logging.Formatter(
-        '%(asctime)s - %(levelname)s - [%(name)s] %(message)s')
-    handler.setFormatter(formatter)
+    if name in _log_names:
+        return _log
+    _log_names.add(name)
+    if CLI_MODE:
+        handler = logging.StreamHandler()
+        formatter = logging.Formatter(
+            '%(asctime)s - %(levelname)s - [%(name)s] %(message)s')
+        handler.setFormatter(formatter)
+    else:
+        handler = XBMCHandler('[%s] ' % name)
+        # Kodi's log is the only destination, as with XBMCFilter
+        _log.propagate = False
     _log.addHandler(handler)
-    _log.addFilter(XBMCFilter('[%s] ' % name))
     return _log
 
 
@@ -54,6 +54,10 @@ class ListItem(object):
     def setProperty(self, key, value):
         self.properties[key.lower()] = value
 
+    def setProperties(self, values):
+        for key, value in values.items():
+            self.setProperty(key, value)
+
     def addStreamInfo(self, stream_type, stream_values):
         self.stream_info.update({stream_type: stream_values})
 
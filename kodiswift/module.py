@@ -65,6 +65,20 @@ class Module(XBMCMixin):
         """Returns this module's added_items"""
         return self.plugin.added_items
 
+    @property
+    def max_added_items(self):
+        """Returns the registered plugin's max_added_items"""
+        return self.plugin.max_added_items
+
+    @property
+    def added_items_count(self):
+        """Returns the registered plugin's added_items_count"""
+        return self.plugin.added_items_count
+
+    @added_items_count.setter
+    def added_items_count(self, value):
+        self.plugin.added_items_count = value
+
     @property
     def handle(self):
         """Returns this module's handle"""
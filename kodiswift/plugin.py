@@ -13,13 +13,17 @@ from __future__ import absolute_import
 
 import collections
 import inspect
+import logging
 import os
 import sys
+import time
 
 import kodiswift
 from kodiswift import xbmc, xbmcaddon, Request
+from kodiswift.common import URLStash, register_url_codec
 from kodiswift.logger import log, setup_log
-from kodiswift.urls import UrlRule, NotFoundException, AmbiguousUrlException
+from kodiswift.urls import (UrlRule, RouteTable, NotFoundException,
+                            AmbiguousUrlException)
 from kodiswift.xbmcmixin import XBMCMixin
 
 __all__ = ['Plugin']
@@ -37,8 +41,12 @@ class Plugin(XBMCMixin):
         >>> plugin = Plugin('Hello Kodi')
     """
 
+    #: Stashed url arguments are removed once unused for this many seconds.
+    url_stash_max_age = 30 * 24 * 60 * 60
+
     def __init__(self, name=None, addon_id=None, plugin_file=None,
-                 info_type=None):
+                 info_type=None, write_behind=False, url_codec=None,
+                 url_stash_size=1024, keep_added_items=None):
         """
         Args:
             name (Optional[str]): The name of the plugin, e.g. 'Hello Kodi'.
@@ -54,15 +62,42 @@ class Plugin(XBMCMixin):
                 since kodiswift requires execution in the root addon directory
                 anyway. The parameter still exists to ease testing.
             info_type (Optional[str):
+            write_behind (Optional[bool]): The default for the write_behind
+                argument of :meth:`~kodiswift.Plugin.cached`. Pass True to
+                defer syncing the function cache until after the listing has
+                been handed to Kodi.
+            url_codec (Optional[object]): The codec which url_for encodes
+                the arguments which aren't strings with, by default a
+                :class:`kodiswift.common.JSONCodec`. It is registered with
+                :func:`kodiswift.common.register_url_codec` so requests
+                can decode them.
+            url_stash_size (Optional[int]): Query string values which are
+                at least this many bytes once encoded are kept in a stash
+                under storage_path, and only a token referring to them is
+                put in the URL. Pass None to always put values in the URL.
+            keep_added_items (Optional[bool]): If False, the ListItems
+                added to Kodi aren't kept in added_items, only counted in
+                added_items_count. Defaults to True on the command line,
+                where added_items is displayed, and False in Kodi.
         """
         self._name = name
         self._routes = []
         self._view_functions = {}
+        # Maps each view function to the first url rule registered for it
+        self._view_func_rules = {}
+        # Built from self._routes on the first dispatch
+        self._route_table = None
         self._addon = xbmcaddon.Addon()
 
         self._addon_id = addon_id or self._addon.getAddonInfo('id')
         self._name = name or self._addon.getAddonInfo('name')
 
+        self.write_behind = write_behind
+
+        self.url_codec = url_codec
+        if url_codec is not None:
+            register_url_codec(url_codec)
+
         self._info_type = info_type
         if not self._info_type:
             types = {
@@ -74,6 +109,11 @@ class Plugin(XBMCMixin):
 
         # Keeps track of the added list items
         self._current_items = []
+        self.added_items_count = 0
+        if keep_added_items is None:
+            keep_added_items = kodiswift.CLI_MODE
+        if not keep_added_items:
+            self.max_added_items = 0
 
         # Gets initialized when self.run() is called
         self._request = None
@@ -94,6 +134,12 @@ class Plugin(XBMCMixin):
         if not os.path.isdir(self._storage_path):
             os.makedirs(self._storage_path)
 
+        self._url_stash = None
+        if url_stash_size:
+            self._url_stash = URLStash(
+                os.path.join(self._storage_path, '.stash'), url_stash_size)
+            register_url_codec(self._url_stash)
+
         # If we are running in CLI, we need to load the strings.xml manually
         # Since kodiswift currently relies on execution from an addon's root
         # directly, we can rely on cwd for now...
@@ -152,7 +198,8 @@ class Plugin(XBMCMixin):
         """The list of currently added items.
 
         Even after repeated calls to :meth:`~kodiswift.Plugin.add_items`, this
-        property will contain the complete list of added items.
+        property will contain the complete list of added items, up to
+        max_added_items. It stays empty if keep_added_items was False.
         """
         return self._current_items
 
@@ -191,6 +238,7 @@ class Plugin(XBMCMixin):
 
     def clear_added_items(self):
         self._current_items = []
+        self.added_items_count = 0
 
     def register_module(self, module, url_prefix):
         """Registers a module with a plugin. Requires a url_prefix that will
@@ -206,17 +254,20 @@ class Plugin(XBMCMixin):
         for func in module.register_funcs:
             func(self, url_prefix)
 
-    def cached_route(self, url_rule, name=None, options=None, ttl=None):
+    def cached_route(self, url_rule, name=None, options=None, ttl=None,
+                     write_behind=None, stale_ttl=None, coalesce=None):
         """A decorator to add a route to a view and also apply caching. The
         url_rule, name and options arguments are the same arguments for the
-        route function. The TTL argument if given will passed along to the
-        caching decorator.
+        route function. The TTL, write_behind, stale_ttl and coalesce
+        arguments if given will be passed along to the caching decorator.
         """
         route_decorator = self.route(url_rule, name=name, options=options)
+        kwargs = {'write_behind': write_behind, 'stale_ttl': stale_ttl,
+                  'coalesce': coalesce}
         if ttl:
-            cache_decorator = self.cached(ttl)
+            cache_decorator = self.cached(ttl, **kwargs)
         else:
-            cache_decorator = self.cached()
+            cache_decorator = self.cached(**kwargs)
 
         def new_decorator(func):
             return route_decorator(cache_decorator(func))
@@ -258,10 +309,13 @@ class Plugin(XBMCMixin):
                         'already a view with that name', url_rule, name)
             self._view_functions[name] = None
         else:
-            log.debug('Adding url rule "%s" named "%s" pointing to function '
-                      '"%s"', url_rule, name, view_func.__name__)
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug('Adding url rule "%s" named "%s" pointing to '
+                          'function "%s"', url_rule, name, view_func.__name__)
             self._view_functions[name] = rule
+            self._view_func_rules.setdefault(view_func, rule)
         self._routes.append(rule)
+        self._route_table = None
 
     def url_for(self, endpoint, **items):
         """Returns a valid Kodi plugin URL for the given endpoint name.
@@ -276,9 +330,8 @@ class Plugin(XBMCMixin):
             rule = self._view_functions[endpoint]
         except KeyError:
             try:
-                rule = (rule for rule in self._view_functions.values()
-                        if rule.view_func == endpoint).next()
-            except StopIteration:
+                rule = self._view_func_rules[endpoint]
+            except KeyError:
                 raise NotFoundException(
                     '%s does not match any known patterns.' % endpoint)
 
@@ -289,7 +342,7 @@ class Plugin(XBMCMixin):
             # TODO: Make this a regular exception
             raise AmbiguousUrlException
 
-        path_qs = rule.make_path_qs(items)
+        path_qs = rule.make_path_qs(items, self.url_codec, self._url_stash)
         return 'plugin://%s%s' % (self._addon_id, path_qs)
 
     def redirect(self, url):
@@ -307,35 +360,57 @@ class Plugin(XBMCMixin):
         items = self._dispatch(self.request.path)
 
         # Close any open storages which will persist them to disk
+        self._join_refreshes()
+        self._sync_deferred_storage()
         if hasattr(self, '_unsynced_storage'):
             for storage in self._unsynced_storage.values():
-                log.debug('Saving a %s storage to disk at "%s"',
-                          storage.file_format, storage.file_path)
                 storage.close()
+                log.debug('Closed a %s storage at "%s" after %d writes and '
+                          '%d skipped writes', storage.file_format,
+                          storage.file_path, storage.writes,
+                          storage.skipped_writes)
+        if self.coalesced_calls or self.coalesce_timeouts:
+            log.debug('%d cache misses were answered by another process, %d '
+                      'timed out waiting', self.coalesced_calls,
+                      self.coalesce_timeouts)
+        self._sweep_url_stash()
 
         return items
 
+    def _sweep_url_stash(self):
+        """Removes the stashed url arguments unused for url_stash_max_age
+        seconds, at most once a day.
+        """
+        if self._url_stash is None:
+            return
+        marker = os.path.join(self.storage_path, '.stash_swept')
+        try:
+            if time.time() - os.path.getmtime(marker) < 24 * 60 * 60:
+                return
+        except OSError:
+            pass
+        removed = self._url_stash.sweep(self.url_stash_max_age)
+        with open(marker, 'w'):
+            pass
+        log.debug('Swept %d expired url arguments from the stash', removed)
+
     def _dispatch(self, path):
-        for rule in self._routes:
-            try:
-                view_func, items = rule.match(path)
-            except NotFoundException:
-                continue
-            log.info('Request for "%s" matches rule for function "%s"',
-                     path, view_func.__name__)
-            resp = view_func(**items)
-
-            # Only call self.finish() for UI container listing calls to plugin
-            # (handle will be >= 0). Do not call self.finish() when called via
-            # RunPlugin() (handle will be -1).
-            if not self._end_of_directory and self.handle >= 0:
-                if isinstance(resp, dict):
-                    resp['items'] = self.finish(**resp)
-                elif isinstance(resp, collections.Iterable):
-                    resp = self.finish(items=resp)
-            return resp
-
-        raise NotFoundException('No matching view found for %s' % path)
+        if self._route_table is None:
+            self._route_table = RouteTable(self._routes)
+        view_func, items = self._route_table.match(path)
+        log.info('Request for "%s" matches rule for function "%s"',
+                 path, view_func.__name__)
+        resp = view_func(**items)
+
+        # Only call self.finish() for UI container listing calls to plugin
+        # (handle will be >= 0). Do not call self.finish() when called via
+        # RunPlugin() (handle will be -1).
+        if not self._end_of_directory and self.handle >= 0:
+            if isinstance(resp, dict):
+                resp['items'] = self.finish(**resp)
+            elif isinstance(resp, collections.Iterable):
+                resp = self.finish(items=resp)
+        return resp
 
     @staticmethod
     def _parse_request(url=None, handle=None):
@@ -11,13 +11,98 @@ request from Kodi.
 """
 from __future__ import absolute_import
 
+import collections
+import urllib
 import urlparse
 
-from kodiswift.common import unpickle_args
+from kodiswift.common import url_codecs
 
 __all__ = ['Request']
 
 
+class _LazyArgs(collections.MutableMapping):
+    """The arguments of a query string, as returned by
+    :func:`kodiswift.common.unpickle_args` but decoded with any of the
+    registered url codecs. The query string is only split when the arguments
+    are first used, and a value is only unquoted and decoded when its key is
+    first read.
+    """
+
+    def __init__(self, query_string):
+        self._query_string = query_string
+        self._args = None
+        # Keys whose values are still quoted, and the codecs of the keys
+        # whose values are still encoded
+        self._quoted = None
+        self._encoded = None
+
+    def _parse(self):
+        """Splits the query string like urlparse.parse_qs, leaving the
+        values quoted.
+        """
+        args = {}
+        for part in self._query_string.split('&'):
+            for pair in part.split(';'):
+                name, sep, value = pair.partition('=')
+                if value:
+                    name = urllib.unquote(name.replace('+', ' '))
+                    args.setdefault(name, []).append(value)
+        self._quoted = set(args)
+        self._encoded = {}
+        for marker, codec in url_codecs.items():
+            keys = args.pop(marker, None)
+            if keys is not None:
+                keys = urllib.unquote(keys[0].replace('+', ' '))
+                for key in keys.split(','):
+                    if key in args:
+                        self._encoded[key] = codec
+        self._args = args
+
+    def __getitem__(self, key):
+        if self._args is None:
+            self._parse()
+        if key in self._quoted:
+            self._args[key] = [urllib.unquote(val.replace('+', ' '))
+                               for val in self._args[key]]
+            self._quoted.discard(key)
+        if key in self._encoded:
+            codec = self._encoded.pop(key)
+            self._args[key] = [codec.loads(val) for val in self._args[key]]
+        return self._args[key]
+
+    def __setitem__(self, key, value):
+        if self._args is None:
+            self._parse()
+        self._args[key] = value
+        self._quoted.discard(key)
+        self._encoded.pop(key, None)
+
+    def __delitem__(self, key):
+        if self._args is None:
+            self._parse()
+        del self._args[key]
+        self._quoted.discard(key)
+        self._encoded.pop(key, None)
+
+    def __iter__(self):
+        if self._args is None:
+            self._parse()
+        return iter(self._args)
+
+    def __len__(self):
+        if self._args is None:
+            self._parse()
+        return len(self._args)
+
+    def __contains__(self, key):
+        if self._args is None:
+            self._parse()
+        return key in self._args
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
 class Request(object):
 
     def __init__(self, url, handle):
@@ -43,4 +128,6 @@ class Request(object):
         parts = urlparse.urlparse(remainder)
         self.netloc, self.path, self.query_string = (
             parts[1], parts[2], parts[4])
-        self.args = unpickle_args(urlparse.parse_qs(self.query_string))
+        #: The query string arguments, a dict of lists of values which is
+        #: only decoded when it is used.
+        self.args = _LazyArgs(self.query_string)
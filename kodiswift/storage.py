@@ -12,17 +12,37 @@ from __future__ import absolute_import
 
 import collections
 import json
+import marshal
+import mmap
 import os
+import struct
 import time
 import shutil
-from datetime import datetime
+import sqlite3
+import threading
+import zlib
+from datetime import timedelta
 
 try:
     import cPickle as pickle
 except ImportError:
     import pickle
 
-__all__ = ['Formats', 'PersistentStorage', 'TimedStorage', 'UnknownFormat']
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where storages can't be locked
+    fcntl = None
+
+from kodiswift.logger import log
+
+__all__ = ['Formats', 'PersistentStorage', 'TimedStorage', 'SQLiteStorage',
+           'SnapshotStorage', 'UnknownFormat', 'detect_format']
 
 
 class UnknownFormat(Exception):
@@ -32,29 +52,187 @@ class UnknownFormat(Exception):
 class Formats(object):
     PICKLE = 'pickle'
     JSON = 'json'
+    LOG = 'log'
+    SQLITE = 'sqlite'
+    MARSHAL = 'marshal'
+    SNAPSHOT = 'snapshot'
+
+
+# Files in the formats kodiswift defines itself start with a versioned
+# header, e.g. 'KSWIFT\x01log\n'. Pickle, JSON and SQLite files are
+# recognised by their own leading bytes, which keeps them readable by
+# anything that understands the plain format.
+_HEADER_MAGIC = 'KSWIFT'
+_HEADER_VERSION = '\x01'
+_HEADER_FORMATS = (Formats.LOG, Formats.MARSHAL, Formats.SNAPSHOT)
+_SQLITE_HEADER = 'SQLite format 3\x00'
+_PICKLE_PROTO_2 = '\x80\x02'
+
+
+def _header(file_format):
+    """Returns the header written at the start of a file in one of the
+    _HEADER_FORMATS.
+    """
+    return _HEADER_MAGIC + _HEADER_VERSION + file_format + '\n'
+
+
+def _sniff(f):
+    """Reads the format of an open storage file from its first bytes.
+
+    Returns:
+        tuple: The format, or None if it couldn't be told from the header,
+            and the offset at which the data of that format starts.
+    """
+    head = f.read(64)
+    if head.startswith(_HEADER_MAGIC + _HEADER_VERSION):
+        file_format, sep, _ = head[len(_HEADER_MAGIC) + 1:].partition('\n')
+        if sep and file_format in _HEADER_FORMATS:
+            return file_format, len(_header(file_format))
+    elif head.startswith(_SQLITE_HEADER):
+        return Formats.SQLITE, 0
+    elif head.startswith(_PICKLE_PROTO_2):
+        return Formats.PICKLE, 0
+    elif head.lstrip().startswith('{'):
+        return Formats.JSON, 0
+    return None, 0
+
+
+# Values of these types can't be mutated in place
+_IMMUTABLE_TYPES = (basestring, int, long, float, bool, type(None))
+
+
+def detect_format(file_path):
+    """Returns the format of an existing storage file when it can be told
+    from the file's header, or None otherwise.
+
+    Args:
+        file_path (str):
+
+    Returns:
+        Optional[str]: One of the :class:`Formats`.
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            return _sniff(f)[0]
+    except IOError:
+        return None
+
+
+class _FileLock(object):
+    """An exclusive lock held on a file for the duration of a with block,
+    shared with every other process locking the same path. Does nothing on
+    platforms without fcntl.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._file = open(self.path, 'a')
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._file is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+def _ttl_seconds(ttl):
+    """Converts a ttl given as a timedelta or a number of seconds to a
+    float, or None for no expiration.
+    """
+    if not ttl:
+        return None
+    if isinstance(ttl, timedelta):
+        return ttl.total_seconds()
+    return float(ttl)
+
+
+def _key_bytes(key):
+    """Pickles a key without the memo, which would make equal keys pickle
+    differently depending on which of their objects are shared.
+    """
+    f = StringIO()
+    pickler = pickle.Pickler(f, 2)
+    pickler.fast = 1
+    pickler.dump(key)
+    return f.getvalue()
 
 
 class PersistentStorage(collections.MutableMapping):
-    def __init__(self, file_path, file_format=Formats.PICKLE):
+    #: A log file is compacted once this fraction of it is dead records.
+    log_compact_ratio = 0.5
+    #: Smaller amounts of dead space are never worth a compaction.
+    log_compact_min_bytes = 64 * 1024
+    #: Whether in place changes to values read from the storage are found
+    #: and synced. Each sync pickles every mutable value read so far to find
+    #: them, storages which never mutate their values can turn this off.
+    track_mutations = True
+
+    def __init__(self, file_path, file_format=Formats.PICKLE, lock=False):
         """
         Args:
             file_path (str):
             file_format (Optional[kodiswift.Formats]):
+            lock (bool): If True, the storage can be shared by several
+                processes. Syncs are serialized with a lock file and merge
+                the keys changed by this process into the file on disk
+                instead of overwriting the changes of other processes.
         """
         super(PersistentStorage, self).__init__()
         self.file_path = file_path
         self.file_format = file_format
+        self.lock = lock
         self._store = {}
         self._loaded = False
 
+        # Keys changed or deleted since the last sync
+        self._changed = set()
+        self._deleted = set()
+
+        # True once the store has been modified since the last sync
+        self._dirty = False
+        # Pickled snapshots of the mutable values read through __getitem__,
+        # used to find values which were mutated in place
+        self._snapshots = {}
+
+        #: The number of syncs which wrote to disk
+        self.writes = 0
+        #: The number of syncs skipped because nothing had changed
+        self.skipped_writes = 0
+
+        # Bookkeeping for the Formats.LOG format. _log_sizes maps every key
+        # to the size of its live record and is None until the file on disk
+        # is known to be a valid log.
+        self._log_sizes = None
+        self._log_size = 0
+        self._log_dead = 0
+        self._log_lock = threading.RLock()
+        self._log_inode = None
+        self._compaction = None
+
     def __getitem__(self, key):
-        return self._store[key]
+        value = self._store[key]
+        self._snapshot(key, value)
+        return value
 
     def __setitem__(self, key, value):
         self._store[key] = value
+        self._changed.add(key)
+        self._deleted.discard(key)
+        self._snapshots.pop(key, None)
+        self._dirty = True
 
     def __delitem__(self, key):
         del self._store[key]
+        self._deleted.add(key)
+        self._changed.discard(key)
+        self._snapshots.pop(key, None)
+        self._dirty = True
 
     def __iter__(self):
         return iter(self._store)
@@ -76,6 +254,53 @@ class PersistentStorage(collections.MutableMapping):
     def items(self):
         return self._store.items()
 
+    def clear(self):
+        if self._store:
+            self._dirty = True
+        self._deleted.update(self._store)
+        self._changed.clear()
+        self._snapshots.clear()
+        self._store.clear()
+
+    def _value(self, key):
+        """Returns the value stored for key, without any bookkeeping."""
+        return self._store[key]
+
+    def _snapshot(self, key, value):
+        """Remembers the pickled state of a mutable value handed out by
+        __getitem__, unless the key is already known to be changed.
+        """
+        if (not self.track_mutations or isinstance(value, _IMMUTABLE_TYPES) or
+                key in self._snapshots or key in self._changed):
+            return
+        try:
+            self._snapshots[key] = pickle.dumps(value, 2)
+        except Exception:
+            # Can't tell if an unpicklable value changes, so assume it does
+            self._changed.add(key)
+            self._dirty = True
+
+    def _find_mutations(self):
+        """Marks the keys whose values were mutated in place since they
+        were read as changed.
+        """
+        if not self.track_mutations:
+            return
+        for key, data in self._snapshots.items():
+            new_data = pickle.dumps(self._value(key), 2)
+            if new_data != data:
+                self._changed.add(key)
+                self._snapshots[key] = new_data
+                self._dirty = True
+
+    @property
+    def dirty(self):
+        """True if the storage has changes which haven't been synced to
+        disk, including in place changes to values read from it.
+        """
+        self._find_mutations()
+        return self._dirty
+
     def load(self):
         """Load the file from disk.
 
@@ -89,23 +314,169 @@ class PersistentStorage(collections.MutableMapping):
 
         if not self._loaded and os.path.exists(self.file_path):
             with open(self.file_path, 'rb') as f:
-                for loader in (pickle.load, json.load):
+                file_format, offset = _sniff(f)
+                f.seek(offset)
+                if file_format is not None:
                     try:
-                        f.seek(0)
-                        self._store = loader(f)
-                        self._loaded = True
-                        break
-                    except pickle.UnpicklingError:
-                        pass
+                        self._load_format(f, file_format)
+                    except Exception:
+                        raise UnknownFormat('Failed to load file')
+                    self.file_format = file_format
+                    self._loaded = True
+                else:
+                    # Files written by older versions with another pickle
+                    # protocol can only be told apart by trying to load them
+                    for loader in (pickle.load, json.load):
+                        try:
+                            f.seek(0)
+                            self._store = loader(f)
+                            self._loaded = True
+                            break
+                        except pickle.UnpicklingError:
+                            pass
             # If the file exists and wasn't able to be loaded, raise an error.
             if not self._loaded:
                 raise UnknownFormat('Failed to load file')
         return self._loaded
 
+    def _load_format(self, f, file_format):
+        """Loads the store from an open file in the given format."""
+        if file_format == Formats.PICKLE:
+            self._store = pickle.load(f)
+        elif file_format == Formats.JSON:
+            self._store = json.load(f)
+        elif file_format == Formats.MARSHAL:
+            self._store = marshal.load(f)
+        elif file_format == Formats.LOG:
+            self._replay_log(f)
+        else:
+            raise NotImplementedError(
+                'Unknown file format ' + repr(file_format))
+
+    def _replay_log(self, f):
+        """Rebuilds the store by applying every record of a log file in
+        order. A torn record at the end of the file, left by a process that
+        died mid-write, is dropped and forces a full rewrite on next sync.
+        """
+        self._store, self._log_sizes = self._apply_log(f, {}, {}, 0)
+
+    def _apply_log(self, f, store, sizes, dead):
+        """Applies the records from the current position of a log file to
+        store and the log bookkeeping, which starts from sizes and dead.
+
+        Returns:
+            tuple: The store and the sizes of the live records, which are
+                None if the log ends with a torn record.
+        """
+        start = f.tell()
+        while True:
+            try:
+                record = pickle.load(f)
+            except Exception:
+                break
+            end = f.tell()
+            key = record[1]
+            dead += sizes.pop(key, 0)
+            if record[0] == 's':
+                store[key] = record[2]
+                sizes[key] = end - start
+            else:
+                store.pop(key, None)
+                dead += end - start
+            start = end
+        stat = os.fstat(f.fileno())
+        if start != stat.st_size:
+            return store, None
+        self._log_size, self._log_dead = start, dead
+        self._log_inode = stat.st_ino
+        return store, sizes
+
     def close(self):
         self.sync()
+        compaction = self._compaction
+        if compaction is not None:
+            compaction.join()
 
     def sync(self):
+        """Writes the storage to disk. Nothing is written if the storage
+        hasn't changed since the last sync and the file already exists.
+        """
+        if not self.dirty and os.path.exists(self.file_path):
+            self.skipped_writes += 1
+            return
+        if self.lock:
+            with _FileLock(self._lock_path()):
+                self._merge()
+                self._write()
+        else:
+            self._write()
+        self.writes += 1
+        self._changed.clear()
+        self._deleted.clear()
+        self._dirty = False
+
+    def refresh(self):
+        """Reads the keys written to the file by other processes since it
+        was loaded. Changes which haven't been synced yet are kept.
+        """
+        if self.lock:
+            with _FileLock(self._lock_path()):
+                self._merge()
+        else:
+            self._merge()
+
+    def _write(self):
+        if self.file_format == Formats.LOG:
+            self._sync_log()
+        else:
+            self._dump()
+
+    def _lock_path(self):
+        """Returns the path of the hidden lock file guarding file_path."""
+        head, tail = os.path.split(self.file_path)
+        return os.path.join(head, '.' + tail + '.lock')
+
+    def _merge(self):
+        """Replaces the store with the file on disk, as other processes may
+        have written it since it was loaded, with the keys changed or deleted
+        by this process applied on top. Must be called with the lock held.
+        """
+        if not os.path.exists(self.file_path):
+            return
+        if self.file_format == Formats.LOG and self._log_sizes is not None:
+            stat = os.stat(self.file_path)
+            if stat.st_ino == self._log_inode:
+                if stat.st_size > self._log_size:
+                    # Only records appended by other processes need reading
+                    with open(self.file_path, 'rb') as f:
+                        f.seek(self._log_size)
+                        store, self._log_sizes = self._apply_log(
+                            f, dict(self._store), self._log_sizes,
+                            self._log_dead)
+                    self._merge_store(store)
+                return
+
+        on_disk = PersistentStorage(self.file_path, self.file_format)
+        on_disk.load()
+        if on_disk.file_format == Formats.LOG:
+            self._log_sizes = on_disk._log_sizes
+            self._log_size = on_disk._log_size
+            self._log_dead = on_disk._log_dead
+            self._log_inode = on_disk._log_inode
+        self._merge_store(on_disk._store)
+
+    def _merge_store(self, store):
+        for key in self._changed:
+            if key in self._store:
+                store[key] = self._store[key]
+        for key in self._deleted:
+            store.pop(key, None)
+        for key in list(self._snapshots):
+            if store.get(key) is not self._store.get(key):
+                del self._snapshots[key]
+        self._store = store
+
+    def _dump(self):
         temp_file = self.file_path + '.tmp'
         try:
             with open(temp_file, 'wb') as f:
@@ -113,6 +484,9 @@ class PersistentStorage(collections.MutableMapping):
                     pickle.dump(self._store, f, 2)
                 elif self.file_format == Formats.JSON:
                     json.dump(self._store, f, separators=(',', ':'))
+                elif self.file_format == Formats.MARSHAL:
+                    f.write(_header(Formats.MARSHAL))
+                    marshal.dump(self._store, f, 2)
                 else:
                     raise NotImplementedError(
                         'Unknown file format ' + repr(self.file_format))
@@ -122,42 +496,731 @@ class PersistentStorage(collections.MutableMapping):
             raise
         shutil.move(temp_file, self.file_path)
 
+    def _sync_log(self):
+        """Appends a record for every key changed or deleted since the last
+        sync. The whole log is rewritten when there is no valid log on disk
+        yet, and compacted in a background thread once enough of it is dead.
+        """
+        with self._log_lock:
+            if self._log_sizes is None or not os.path.exists(self.file_path):
+                self.compact()
+                return
+            sizes = self._log_sizes
+            with open(self.file_path, 'ab') as f:
+                for key in self._changed:
+                    if key not in self._store:
+                        continue
+                    data = pickle.dumps(('s', key, self._store[key]), 2)
+                    f.write(data)
+                    self._log_dead += sizes.get(key, 0)
+                    sizes[key] = len(data)
+                    self._log_size += len(data)
+                for key in self._deleted:
+                    if key not in sizes:
+                        continue
+                    data = pickle.dumps(('d', key), 2)
+                    f.write(data)
+                    self._log_dead += sizes.pop(key) + len(data)
+                    self._log_size += len(data)
+
+            if (self._log_dead >= self.log_compact_min_bytes and
+                    self._log_dead >= self._log_size * self.log_compact_ratio
+                    and self._compaction is None):
+                if self.lock:
+                    # Other processes may append as soon as the lock is
+                    # released, so compact while it is still held
+                    self.compact()
+                    return
+                self._compaction = threading.Thread(
+                    target=self._background_compact)
+                self._compaction.start()
+
+    def _background_compact(self):
+        try:
+            self.compact()
+        finally:
+            self._compaction = None
+
+    def compact(self):
+        """Rewrites a Formats.LOG file with a single record per live key.
+        """
+        with self._log_lock:
+            temp_file = self.file_path + '.tmp'
+            sizes = {}
+            try:
+                with open(temp_file, 'wb') as f:
+                    f.write(_header(Formats.LOG))
+                    for key, value in self._store.items():
+                        data = pickle.dumps(('s', key, value), 2)
+                        f.write(data)
+                        sizes[key] = len(data)
+            except Exception:
+                if os.path.exists(temp_file):
+                    os.remove(temp_file)
+                raise
+            shutil.move(temp_file, self.file_path)
+            self._log_sizes = sizes
+            self._log_size = (len(_header(Formats.LOG)) +
+                              sum(sizes.values()))
+            self._log_dead = 0
+            self._log_inode = os.stat(self.file_path).st_ino
+
 
 class TimedStorage(PersistentStorage):
-    """A dict with the ability to persist to disk and TTL for items."""
+    """A dict with the ability to persist to disk and TTL for items.
 
-    def __init__(self, file_path, ttl=None, **kwargs):
+    The storage can also be capped to a number of entries and/or a number of
+    bytes. When it is loaded or synced, expired entries are evicted first,
+    then the least recently used entries until it fits. An entry was last
+    used when it was written or, during the current process, when it was
+    last read.
+    """
+
+    def __init__(self, file_path, ttl=None, max_entries=None, max_bytes=None,
+                 **kwargs):
         """
         Args:
             file_path (str):
-            ttl (Optional[int]):
+            ttl (Optional[Union[datetime.timedelta, float]]): A timedelta
+                or a number of seconds.
+            max_entries (Optional[int]): The most entries to keep.
+            max_bytes (Optional[int]): The most bytes of pickled entries to
+                keep.
         """
         super(TimedStorage, self).__init__(file_path, **kwargs)
         self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # When each key was last read in this process, only kept if the
+        # storage is capped
+        self._atimes = {}
+        #: The number of entries and bytes reclaimed by the last sweep
+        self.last_sweep = (0, 0)
 
     def __setitem__(self, key, value):
-        self._store[key] = (value, time.time())
+        super(TimedStorage, self).__setitem__(key, (value, time.time()))
+
+    @property
+    def ttl(self):
+        """The time to live for items, as given to the constructor."""
+        return self._ttl
+
+    @ttl.setter
+    def ttl(self, value):
+        self._ttl = value
+        self._ttl_seconds = _ttl_seconds(value)
+
+    def _cutoff(self):
+        """Returns the timestamp before which entries are expired, or None
+        if entries never expire.
+        """
+        if self._ttl_seconds is None:
+            return None
+        return time.time() - self._ttl_seconds
 
     def __getitem__(self, item):
         val, timestamp = self._store[item]
-        ttl_diff = datetime.utcnow() - datetime.utcfromtimestamp(timestamp)
-        if self.ttl and ttl_diff > self.ttl:
-            del self._store[item]
+        if (self._ttl_seconds is not None and
+                time.time() - timestamp > self._ttl_seconds):
+            del self[item]
             raise KeyError
+        if not isinstance(val, _IMMUTABLE_TYPES):
+            self._snapshot(item, val)
+        if self.max_entries or self.max_bytes:
+            self._atimes[item] = time.time()
         return val
 
+    def entry(self, key):
+        """Returns the value stored for key along with the time it was
+        written, even if it has expired.
+
+        Returns:
+            tuple: The value and its timestamp.
+        """
+        val, timestamp = self._store[key]
+        if not isinstance(val, _IMMUTABLE_TYPES):
+            self._snapshot(key, val)
+        if self.max_entries or self.max_bytes:
+            self._atimes[key] = time.time()
+        return val, timestamp
+
+    def _value(self, key):
+        return self._store[key][0]
+
+    def _entry_size(self, key):
+        return len(pickle.dumps((key, self._store[key]), 2))
+
+    def sweep(self):
+        """Evicts the expired entries, then the least recently used entries
+        until the storage fits within max_entries and max_bytes.
+
+        Returns:
+            tuple: The number of entries and of bytes reclaimed.
+        """
+        evicted = self._expired_keys()
+
+        sizes = {}
+        if self.max_entries or self.max_bytes:
+            expired = set(evicted)
+            atimes = self._atimes
+            live = sorted((max(timestamp, atimes.get(key, 0)), key)
+                          for key, (_, timestamp) in self._store.items()
+                          if key not in expired)
+            excess = len(live) - (self.max_entries or len(live))
+            if self.max_bytes:
+                sizes = dict((key, self._entry_size(key)) for _, key in live)
+                total = sum(sizes.values())
+            else:
+                total = 0
+            for _, key in live:
+                if excess <= 0 and (not self.max_bytes or
+                                    total <= self.max_bytes):
+                    break
+                evicted.append(key)
+                excess -= 1
+                total -= sizes.get(key, 0)
+
+        reclaimed = 0
+        for key in evicted:
+            reclaimed += sizes.get(key) or self._entry_size(key)
+            del self[key]
+            self._atimes.pop(key, None)
+
+        self.last_sweep = (len(evicted), reclaimed)
+        if evicted:
+            log.debug('Swept %d entries (%d bytes) from storage "%s"',
+                      len(evicted), reclaimed, self.file_path)
+        return self.last_sweep
+
+    def load(self):
+        loaded = super(TimedStorage, self).load()
+        if self.max_entries or self.max_bytes:
+            self.sweep()
+        return loaded
+
     def __repr__(self):
         return '%s(%r)' % (self.__class__.__name__,
                            dict((k, v[0]) for k, v in self._store.items()))
 
+    def _expired_keys(self):
+        cutoff = self._cutoff()
+        if cutoff is None:
+            return []
+        return [key for key, (_, timestamp) in self._store.iteritems()
+                if timestamp < cutoff]
+
+    def purge_expired(self):
+        """Removes every expired item in a single pass.
+
+        Returns:
+            int: The number of items removed.
+        """
+        expired = self._expired_keys()
+        for key in expired:
+            del self[key]
+        return len(expired)
+
     def items(self):
-        items = []
-        for k in self._store.keys():
-            try:
-                items.append((k, self[k]))
-            except KeyError:
-                pass
+        cutoff = self._cutoff()
+        if cutoff is None:
+            cutoff = float('-inf')
+        items, expired = [], []
+        for key, (val, timestamp) in self._store.iteritems():
+            if timestamp < cutoff:
+                expired.append(key)
+                continue
+            items.append((key, val))
+            if not isinstance(val, _IMMUTABLE_TYPES):
+                self._snapshot(key, val)
+        for key in expired:
+            del self[key]
         return items
 
     def sync(self):
+        if self.max_entries or self.max_bytes:
+            self.sweep()
         super(TimedStorage, self).sync()
+
+
+class SQLiteStorage(collections.MutableMapping):
+    """A TimedStorage kept in a SQLite database.
+
+    Unlike :class:`TimedStorage` nothing is read into memory when the storage
+    is loaded, each value is read from the database the first time its key
+    is requested. Writes are kept in memory and committed in a single
+    transaction on :meth:`sync`.
+    """
+    #: Whether in place changes to values read from the storage are found
+    #: and committed, see :attr:`PersistentStorage.track_mutations`.
+    track_mutations = True
+
+    def __init__(self, file_path, ttl=None, file_format=Formats.SQLITE,
+                 max_entries=None, max_bytes=None):
+        """
+        Args:
+            file_path (str):
+            ttl (Optional[Union[datetime.timedelta, float]]): A timedelta
+                or a number of seconds.
+            file_format (Optional[kodiswift.Formats]): Always
+                Formats.SQLITE, accepted for compatibility with TimedStorage.
+            max_entries (Optional[int]): The most entries to keep.
+            max_bytes (Optional[int]): The most bytes of pickled keys and
+                values to keep.
+        """
+        super(SQLiteStorage, self).__init__()
+        self.file_path = file_path
+        self.file_format = Formats.SQLITE
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        #: The number of entries and bytes reclaimed by the last sweep
+        self.last_sweep = (0, 0)
+        self._conn = None
+
+        # Values read in this session, key -> (value, pickled value,
+        # timestamp). The pickled value is used on sync to find values which
+        # were mutated in place.
+        self._cache = {}
+        # Writes not committed yet, key -> (value, timestamp), or None for a
+        # deleted key
+        self._pending = {}
+        self._cleared = False
+
+        #: The number of syncs which wrote to the database
+        self.writes = 0
+        #: The number of syncs skipped because nothing had changed
+        self.skipped_writes = 0
+
+    def _connect(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.file_path, check_same_thread=False)
+            conn.text_factory = str
+            conn.execute('CREATE TABLE IF NOT EXISTS storage ('
+                         'key BLOB PRIMARY KEY, value BLOB NOT NULL, '
+                         'timestamp REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS storage_timestamp '
+                         'ON storage (timestamp)')
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    @property
+    def ttl(self):
+        """The time to live for items, as given to the constructor."""
+        return self._ttl
+
+    @ttl.setter
+    def ttl(self, value):
+        self._ttl = value
+        self._ttl_seconds = _ttl_seconds(value)
+
+    def _cutoff(self):
+        """Returns the timestamp before which entries are expired, or None
+        if entries never expire.
+        """
+        if self._ttl_seconds is None:
+            return None
+        return time.time() - self._ttl_seconds
+
+    @staticmethod
+    def _dump_key(key):
+        return sqlite3.Binary(_key_bytes(key))
+
+    def __getitem__(self, key):
+        return self._entry(key, self._cutoff())[0]
+
+    def entry(self, key):
+        """Returns the value stored for key along with the time it was
+        written, even if it has expired.
+
+        Returns:
+            tuple: The value and its timestamp.
+        """
+        return self._entry(key, None)
+
+    def _entry(self, key, cutoff):
+        if key in self._pending:
+            entry = self._pending[key]
+            if entry is None:
+                raise KeyError(key)
+            return entry
+        if key in self._cache:
+            value, data, timestamp = self._cache[key]
+        elif self._cleared:
+            raise KeyError(key)
+        else:
+            row = self._connect().execute(
+                'SELECT value, timestamp FROM storage WHERE key = ?',
+                (self._dump_key(key),)).fetchone()
+            if row is None:
+                raise KeyError(key)
+            data, timestamp = str(row[0]), row[1]
+            value = None
+        if cutoff is not None and timestamp < cutoff:
+            self._pending[key] = None
+            self._cache.pop(key, None)
+            raise KeyError(key)
+        if key not in self._cache:
+            value = pickle.loads(data)
+            self._cache[key] = (value, data, timestamp)
+        return value, timestamp
+
+    def __setitem__(self, key, value):
+        self._pending[key] = (value, time.time())
+        self._cache.pop(key, None)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._pending[key] = None
+        self._cache.pop(key, None)
+
+    def _stored_keys(self):
+        if self._cleared:
+            return []
+        cutoff = self._cutoff()
+        if cutoff is None:
+            rows = self._connect().execute('SELECT key FROM storage')
+        else:
+            rows = self._connect().execute(
+                'SELECT key FROM storage WHERE timestamp >= ?', (cutoff,))
+        return [pickle.loads(str(row[0])) for row in rows]
+
+    def __iter__(self):
+        keys = [key for key in self._stored_keys()
+                if key not in self._pending]
+        keys.extend(key for key, entry in self._pending.items()
+                    if entry is not None)
+        return iter(keys)
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def __enter__(self):
+        self.load()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.sync()
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, dict(self.items()))
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def clear(self):
+        self._cleared = True
+        self._pending.clear()
+        self._cache.clear()
+
+    def _mutated_keys(self):
+        """Returns the keys whose values were mutated in place since they
+        were read from the database.
+        """
+        if not self.track_mutations:
+            return []
+        return [key for key, (value, data, _) in self._cache.items()
+                if not isinstance(value, _IMMUTABLE_TYPES) and
+                pickle.dumps(value, 2) != data]
+
+    def refresh(self):
+        """Forgets the values read so far, except for those mutated in
+        place, so they are read again with the changes of other processes.
+        """
+        mutated = set(self._mutated_keys())
+        for key in list(self._cache):
+            if key not in mutated:
+                del self._cache[key]
+
+    @property
+    def dirty(self):
+        """True if the storage has changes which haven't been committed,
+        including in place changes to values read from it.
+        """
+        return bool(self._pending or self._cleared or self._mutated_keys())
+
+    def load(self):
+        """Opens the database and deletes any expired entries.
+
+        Returns:
+            bool: Always True, values are read when they are requested.
+
+        Raises:
+            UnknownFormat: When the file exists but isn't a valid database.
+        """
+        try:
+            self.sweep()
+        except sqlite3.DatabaseError:
+            raise UnknownFormat('Failed to load file')
+        return True
+
+    def sweep(self):
+        """Deletes the expired entries, then the least recently written
+        entries until the storage fits within max_entries and max_bytes.
+
+        Returns:
+            tuple: The number of entries and of bytes reclaimed.
+        """
+        conn = self._connect()
+        cutoff = self._cutoff()
+        entries, reclaimed = 0, 0
+        with conn:
+            if cutoff is not None:
+                count, size = conn.execute(
+                    'SELECT COUNT(*), TOTAL(LENGTH(key) + LENGTH(value)) '
+                    'FROM storage WHERE timestamp < ?', (cutoff,)).fetchone()
+                if count:
+                    conn.execute('DELETE FROM storage WHERE timestamp < ?',
+                                 (cutoff,))
+                    entries, reclaimed = count, int(size)
+
+            if self.max_entries or self.max_bytes:
+                rows = conn.execute(
+                    'SELECT key, LENGTH(key) + LENGTH(value) FROM storage '
+                    'ORDER BY timestamp DESC').fetchall()
+                evicted, total = [], 0
+                for i, (key, size) in enumerate(rows):
+                    total += size
+                    if (self.max_entries and i >= self.max_entries or
+                            self.max_bytes and total > self.max_bytes):
+                        evicted.append((key,))
+                        reclaimed += size
+                conn.executemany('DELETE FROM storage WHERE key = ?', evicted)
+                entries += len(evicted)
+                for (key,) in evicted:
+                    self._cache.pop(pickle.loads(str(key)), None)
+
+        self.last_sweep = (entries, reclaimed)
+        if entries:
+            log.debug('Swept %d entries (%d bytes) from storage "%s"',
+                      entries, reclaimed, self.file_path)
+        return self.last_sweep
+
+    def sync(self):
+        """Commits every write made since the last sync in a single
+        transaction.
+        """
+        rows, deleted = [], []
+        # Values read from the database might have been mutated in place
+        for key in self._mutated_keys():
+            value, _, timestamp = self._cache[key]
+            data = pickle.dumps(value, 2)
+            rows.append((self._dump_key(key), sqlite3.Binary(data), timestamp))
+            self._cache[key] = (value, data, timestamp)
+        if not (rows or self._pending or self._cleared):
+            self.skipped_writes += 1
+            return
+
+        for key, entry in self._pending.items():
+            if entry is None:
+                deleted.append((self._dump_key(key),))
+            else:
+                value, timestamp = entry
+                data = pickle.dumps(value, 2)
+                rows.append((self._dump_key(key), sqlite3.Binary(data),
+                             timestamp))
+                self._cache[key] = (value, data, timestamp)
+
+        conn = self._connect()
+        with conn:
+            if self._cleared:
+                conn.execute('DELETE FROM storage')
+            conn.executemany('DELETE FROM storage WHERE key = ?', deleted)
+            conn.executemany('INSERT OR REPLACE INTO storage '
+                             '(key, value, timestamp) VALUES (?, ?, ?)', rows)
+        self.writes += 1
+        self._pending.clear()
+        self._cleared = False
+        if self.max_entries or self.max_bytes:
+            self.sweep()
+
+    def close(self):
+        self.sync()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class SnapshotStorage(collections.Mapping):
+    """A read only storage memory mapped from a file built by
+    :meth:`build`.
+
+    Opening a snapshot only reads its header, and looking up a key only
+    unpickles that key's value, so the cost of a lookup doesn't depend on
+    the size of the snapshot. Use it for large catalogs which are built
+    once and read on every run of the addon.
+
+    Keys are matched by their pickled form, so e.g. a str key can't be
+    looked up with the equal unicode string.
+    """
+    # The header is followed by the number of items and of slots in the
+    # hash table, then by the slots. Each slot holds the offset of a record,
+    # or 0 if the slot is empty, and the crc32 of the pickled key. A record
+    # is the length of the pickled key and of the pickled value, followed by
+    # both.
+    _COUNTS = struct.Struct('<II')
+    _SLOT = struct.Struct('<QI')
+    _RECORD = struct.Struct('<II')
+
+    def __init__(self, file_path, file_format=Formats.SNAPSHOT):
+        """
+        Args:
+            file_path (str):
+            file_format (Optional[kodiswift.Formats]): Always
+                Formats.SNAPSHOT.
+        """
+        super(SnapshotStorage, self).__init__()
+        self.file_path = file_path
+        self.file_format = Formats.SNAPSHOT
+        self._map = None
+        self._count = 0
+        self._slots = 0
+        self._table = 0
+
+        #: Always 0, a snapshot is never written
+        self.writes = 0
+        #: The number of syncs, which never have anything to write
+        self.skipped_writes = 0
+
+    @classmethod
+    def build(cls, file_path, source, ttl=None):
+        """Writes a snapshot file.
+
+        Args:
+            file_path (str): Where to write the snapshot.
+            source (Union[str, collections.Mapping]): The items to write, or
+                the path of a :class:`TimedStorage` file to convert.
+            ttl (Optional[Union[datetime.timedelta, float]]): When source is
+                a path, items older than this, as a timedelta or a number of
+                seconds, aren't converted. By default every item is.
+
+        Returns:
+            int: The number of items written.
+        """
+        if isinstance(source, basestring):
+            storage = TimedStorage(source, ttl)
+            storage.load()
+            source = storage
+        records = [(_key_bytes(key), pickle.dumps(value, 2))
+                   for key, value in source.items()]
+
+        slots = max(1, 2 * len(records))
+        table = [(0, 0)] * slots
+        offset = (len(_header(Formats.SNAPSHOT)) + cls._COUNTS.size +
+                  slots * cls._SLOT.size)
+        for key_data, value_data in records:
+            crc = zlib.crc32(key_data) & 0xffffffff
+            slot = crc % slots
+            while table[slot][0]:
+                slot = (slot + 1) % slots
+            table[slot] = (offset, crc)
+            offset += cls._RECORD.size + len(key_data) + len(value_data)
+
+        temp_file = file_path + '.tmp'
+        try:
+            with open(temp_file, 'wb') as f:
+                f.write(_header(Formats.SNAPSHOT))
+                f.write(cls._COUNTS.pack(len(records), slots))
+                f.write(''.join(cls._SLOT.pack(*entry) for entry in table))
+                for key_data, value_data in records:
+                    f.write(cls._RECORD.pack(len(key_data), len(value_data)))
+                    f.write(key_data)
+                    f.write(value_data)
+        except Exception:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+        shutil.move(temp_file, file_path)
+        return len(records)
+
+    def load(self):
+        """Maps the file into memory.
+
+        Returns:
+            bool: True if successfully loaded, False if the file
+                doesn't exist.
+
+        Raises:
+            UnknownFormat: When the file exists but isn't a snapshot.
+        """
+        if self._map is not None:
+            return True
+        if not os.path.exists(self.file_path):
+            return False
+        with open(self.file_path, 'rb') as f:
+            file_format, offset = _sniff(f)
+            if file_format != Formats.SNAPSHOT:
+                raise UnknownFormat('Not a snapshot file')
+            try:
+                snapshot = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._count, self._slots = self._COUNTS.unpack_from(
+                    snapshot, offset)
+            except Exception:
+                raise UnknownFormat('Failed to load file')
+        self._table = offset + self._COUNTS.size
+        self._map = snapshot
+        return True
+
+    def _find(self, key):
+        """Returns the offset and length of the pickled value of key, or
+        None if the snapshot doesn't have it.
+        """
+        if not self._slots:
+            return None
+        key_data = _key_bytes(key)
+        crc = zlib.crc32(key_data) & 0xffffffff
+        slot = crc % self._slots
+        while True:
+            offset, slot_crc = self._SLOT.unpack_from(
+                self._map, self._table + slot * self._SLOT.size)
+            if not offset:
+                return None
+            if slot_crc == crc:
+                key_size, value_size = self._RECORD.unpack_from(
+                    self._map, offset)
+                start = offset + self._RECORD.size
+                if self._map[start:start + key_size] == key_data:
+                    return start + key_size, value_size
+            slot = (slot + 1) % self._slots
+
+    def __getitem__(self, key):
+        found = self._find(key)
+        if found is None:
+            raise KeyError(key)
+        start, size = found
+        return pickle.loads(self._map[start:start + size])
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def __iter__(self):
+        for slot in xrange(self._slots):
+            offset, _ = self._SLOT.unpack_from(
+                self._map, self._table + slot * self._SLOT.size)
+            if offset:
+                key_size, _ = self._RECORD.unpack_from(self._map, offset)
+                start = offset + self._RECORD.size
+                yield pickle.loads(self._map[start:start + key_size])
+
+    def __len__(self):
+        return self._count
+
+    def __enter__(self):
+        self.load()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.file_path)
+
+    def sync(self):
+        self.skipped_writes += 1
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+            self._count = self._slots = 0
@@ -13,9 +13,14 @@ from __future__ import absolute_import
 import re
 from urllib import urlencode, unquote_plus, quote_plus
 
-from kodiswift.common import pickle_dict, unpickle_dict
+from kodiswift.common import decode_dict, encode_dict
 
-__all__ = ['UrlRule', 'AmbiguousUrlException', 'NotFoundException']
+__all__ = ['UrlRule', 'RouteTable', 'AmbiguousUrlException',
+           'NotFoundException']
+
+# Path segments made only of these characters have no special meaning in the
+# regex built by UrlRule, so they can be compared as plain strings.
+_STATIC_SEGMENT = re.compile(r'^[\w\-]+$')
 
 
 class AmbiguousUrlException(Exception):
@@ -55,10 +60,23 @@ class UrlRule(object):
         self._view_func = view_func
         self._options = options or {}
         self._keywords = re.findall(r'<(.+?)>', url_rule)
+        self._keyword_set = frozenset(self._keywords)
 
         # change <> to {} for use with str.format()
         self._url_format = self._url_rule.replace('<', '{').replace('>', '}')
 
+        # Quote the default values for path keywords once, up front, so
+        # building a path only has to quote the items passed to url_for.
+        self._path_defaults = {}
+        self._invalid_defaults = set()
+        for key, val in self._options.items():
+            if key not in self._keyword_set:
+                continue
+            if isinstance(val, basestring):
+                self._path_defaults[key] = quote_plus(val)
+            else:
+                self._invalid_defaults.add(key)
+
         # Make a regex pattern for matching incoming URLs
         rule = self._url_rule
         if rule != '/':
@@ -102,48 +120,33 @@ class UrlRule(object):
         m = self._regex.search(path)
         if not m:
             raise NotFoundException
+        return self._view_func, self._parse_match(m)
 
+    def _parse_match(self, m):
+        """Returns the dictionary of view arguments for a successful regex
+        match against this rule.
+        """
         # urlunencode the values
         items = dict((key, unquote_plus(val))
                      for key, val in m.groupdict().items())
 
-        # unpickle any items if present
-        items = unpickle_dict(items)
+        # decode any items if present
+        items = decode_dict(items)
 
         # We need to update our dictionary with default values provided in
         # options if the keys don't already exist.
         [items.setdefault(key, val) for key, val in self._options.items()]
-        return self._view_func, items
-
-    def _make_path(self, items):
-        """Returns a relative path for the given dictionary of items.
-
-        Uses this url rule's url pattern and replaces instances of <var_name>
-        with the appropriate value from the items dict.
-        """
-        for key, val in items.items():
-            if not isinstance(val, basestring):
-                raise TypeError('Value "%s" for key "%s" must be an instance'
-                                ' of basestring' % (val, key))
-            items[key] = quote_plus(val)
+        return items
 
-        try:
-            path = self._url_format.format(**items)
-        except AttributeError:
-            # Old version of python
-            path = self._url_format
-            for key, val in items.items():
-                path = path.replace('{%s}' % key, val)
-        return path
-
-    def _make_qs(self, items):
+    def _make_qs(self, items, codec=None, stash=None):
         """Returns a query string for the given dictionary of items. All keys
         and values in the provided items will be urlencoded. If necessary, any
-        python objects will be pickled before being urlencoded.
+        python objects will be encoded with the codec before being
+        urlencoded, and large values moved to the stash.
         """
-        return urlencode(pickle_dict(items))
+        return urlencode(encode_dict(items, codec, stash))
 
-    def make_path_qs(self, items):
+    def make_path_qs(self, items, codec=None, stash=None):
         """Returns a relative path complete with query string for the given
         dictionary of items.
 
@@ -152,40 +155,61 @@ class UrlRule(object):
         parameters.
 
         All items will be urlencoded. Any items which are not instances of
-        basestring, or int/long will be pickled before being urlencoded.
-
-        .. warning:: The pickling of items only works for key/value pairs which
-                     will be in the query string. This behavior should only be
-                     used for the simplest of python objects. It causes the
-                     URL to get very lengthy (and unreadable) and Kodi has a
-                     hard limit on URL length. See the caching section if you
-                     need to persist a large amount of data between requests.
+        basestring, or int/long will be encoded with the codec, by default a
+        :class:`kodiswift.common.JSONCodec`, before being urlencoded. If a
+        :class:`kodiswift.common.URLStash` is given, query string values
+        which are too large are replaced by a token referring to the stash.
+
+        .. warning:: The encoding of items only works for key/value pairs
+                     which will be in the query string. This behavior should
+                     only be used for the simplest of python objects. It
+                     causes the URL to get lengthy (and unreadable) and Kodi
+                     has a hard limit on URL length. See the caching section
+                     if you need to persist a large amount of data between
+                     requests.
         """
-        # Convert any ints and longs to strings
+        path_items = self._path_defaults.copy()
+        qs_items = {}
         for key, val in items.items():
+            # Convert any ints and longs to strings
             if isinstance(val, (int, long)):
-                items[key] = str(val)
-
-        # First use our defaults passed when registering the rule
-        url_items = dict((key, val) for key, val in self._options.items()
-                         if key in self._keywords)
-
-        # Now update with any items explicitly passed to url_for
-        url_items.update((key, val) for key, val in items.items()
-                         if key in self._keywords)
+                val = str(val)
+            if key not in self._keyword_set:
+                # Extra arguments get tacked on to the query string
+                qs_items[key] = val
+            elif isinstance(val, basestring):
+                path_items[key] = quote_plus(val)
+            else:
+                raise TypeError('Value "%s" for key "%s" must be an instance'
+                                ' of basestring' % (val, key))
 
-        # Create the path
-        path = self._make_path(url_items)
+        for key in self._invalid_defaults:
+            if key not in items:
+                raise TypeError('Value "%s" for key "%s" must be an instance'
+                                ' of basestring' % (self._options[key], key))
 
-        # Extra arguments get tacked on to the query string
-        qs_items = dict((key, val) for key, val in items.items()
-                        if key not in self._keywords)
-        qs = self._make_qs(qs_items)
+        # Create the path, a rule without keywords is already a static path
+        if self._keywords:
+            path = self._url_format.format(**path_items)
+        else:
+            path = self._url_format
 
-        if qs:
-            return '?'.join([path, qs])
+        if qs_items:
+            return '?'.join([path, self._make_qs(qs_items, codec, stash)])
         return path
 
+    @property
+    def static_prefix(self):
+        """The leading path segments of this url rule which contain no
+        variables, e.g. ``('videos', 'all')`` for ``/videos/all/<page>``.
+        """
+        segments = []
+        for segment in self._url_rule.strip('/').split('/'):
+            if not _STATIC_SEGMENT.match(segment):
+                break
+            segments.append(segment)
+        return tuple(segments)
+
     @property
     def regex(self):
         """The regex for matching paths against this url rule."""
@@ -210,3 +234,74 @@ class UrlRule(object):
     def keywords(self):
         """The list of path keywords for this url rule."""
         return self._keywords
+
+
+class RouteTable(object):
+    """An index of url rules used to resolve incoming paths.
+
+    Rules are bucketed by their static prefix, which makes the table a
+    flattened prefix trie. Resolving a path only tests the regexes of rules
+    whose static segments equal the leading segments of the path, and the
+    first registered rule that matches wins, exactly as if every rule had
+    been tried in order.
+    """
+
+    def __init__(self, rules=()):
+        """
+        Args:
+            rules (Iterable[kodiswift.UrlRule]): The url rules in the order
+                they were registered.
+        """
+        self._buckets = {}
+        self._max_depth = 0
+        self._size = 0
+        for rule in rules:
+            self.add(rule)
+
+    def __len__(self):
+        return self._size
+
+    def add(self, rule):
+        """Appends a url rule to the table. It has a lower priority than
+        every rule added before it.
+
+        Args:
+            rule (kodiswift.UrlRule):
+        """
+        prefix = rule.static_prefix
+        self._buckets.setdefault(prefix, []).append((self._size, rule))
+        self._max_depth = max(self._max_depth, len(prefix))
+        self._size += 1
+
+    def _candidates(self, path):
+        """Returns the rules that could match the given path, in the order
+        they were registered.
+        """
+        stripped = path.strip('/')
+        segments = stripped.split('/') if stripped else []
+        depth = min(len(segments), self._max_depth)
+        buckets = [self._buckets.get(tuple(segments[:i]))
+                   for i in range(depth + 1)]
+        buckets = [bucket for bucket in buckets if bucket]
+        if len(buckets) == 1:
+            return buckets[0]
+        return sorted(entry for bucket in buckets for entry in bucket)
+
+    def match(self, path):
+        """Finds the first registered url rule matching the given path.
+
+        Args:
+            path (str): The URL path.
+
+        Returns:
+            tuple: The matched function and a dictionary of items parsed
+                from the path, as returned by :meth:`UrlRule.match`.
+
+        Raises:
+            NotFoundException: If no url rule matches the path.
+        """
+        for _, rule in self._candidates(path):
+            m = rule.regex.search(path)
+            if m:
+                return rule.view_func, rule._parse_match(m)
+        raise NotFoundException('No matching view found for %s' % path)
@@ -1,19 +1,32 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 
+import collections
+import errno
+import inspect
+import logging
 import os
+import threading
+import time
 import warnings
 from datetime import timedelta
-from functools import wraps
+from functools import partial, wraps
+from itertools import islice
 
 import kodiswift
 from kodiswift import xbmc, xbmcplugin, xbmcgui
+from kodiswift.common import cache_key, key_digest
 from kodiswift.constants import SortMethod
 from kodiswift.logger import log
-from kodiswift.storage import TimedStorage, UnknownFormat
+from kodiswift.storage import (Formats, SnapshotStorage, SQLiteStorage,
+                               TimedStorage, UnknownFormat, detect_format)
 
 __all__ = ['XBMCMixin']
 
+# Marks the thread refreshing stale cached results, which runs once Kodi
+# already has the listing
+_refresh_state = threading.local()
+
 # TODO(Sinap): Need to either break the single mixin into multiple or just use
 #              a parent class.
 
@@ -49,54 +62,459 @@ class XBMCMixin(object):
 
     _function_cache_name = '.functions'
 
-    def cached(self, ttl=60 * 24):
+    #: The default for the write_behind argument of :meth:`cached`.
+    write_behind = False
+    #: The default for the coalesce argument of :meth:`cached`.
+    coalesce = False
+    #: The most seconds a coalesced cache miss waits for another process.
+    coalesce_timeout = 30
+    #: The most results of each function cache memoized in memory.
+    memo_size = 256
+    #: The default for the max_entries argument of :meth:`cached`.
+    function_cache_max_entries = None
+    #: The default for the max_bytes argument of :meth:`cached`.
+    function_cache_max_bytes = None
+    #: The number of cache misses answered by another process.
+    coalesced_calls = 0
+    #: The number of coalesced cache misses which gave up waiting.
+    coalesce_timeouts = 0
+    #: The number of items :meth:`add_items` hands to Kodi at a time when
+    #: given an iterator, such as a generator, instead of a list.
+    add_items_chunk_size = 50
+    #: The most ListItems kept in added_items, None keeps them all.
+    max_added_items = None
+    #: The number of ListItems added, including those not kept.
+    added_items_count = 0
+
+    def cached(self, ttl=60 * 24, write_behind=None, stale_ttl=None,
+               coalesce=None, key_func=None, exclude=None, namespace=None,
+               max_entries=None, max_bytes=None):
         """A decorator that will cache the output of the wrapped function.
 
-        The key used for the cache is the function name as well as the
-        `*args` and `**kwargs` passed to the function.
+        The key used for the cache is a digest of the module and name of the
+        function as well as the `*args` and `**kwargs` passed to the
+        function, see :func:`kodiswift.common.cache_key`.
 
         Args:
-            ttl: Time to live in minutes.
+            ttl: Time to live in minutes. If None or 0, results never
+                expire and stale_ttl has no effect.
+            write_behind (Optional[bool]): If True, a cache miss doesn't
+                sync the cache to disk right away. The cache is synced once,
+                after the directory listing has been handed to Kodi by
+                :meth:`finish`, or when :meth:`kodiswift.Plugin.run`
+                returns. Defaults to the write_behind attribute.
+            stale_ttl (Optional[int]): Minutes past the ttl during which an
+                expired result is still returned. The function is then
+                called again in a background thread, started once the
+                directory listing has been handed to Kodi, and its result
+                replaces the expired one. As Kodi already has the listing,
+                :meth:`finish` and :meth:`set_content` don't touch it from
+                that thread, finish only returns the ListItems of its
+                items.
+            coalesce (Optional[bool]): If True, when several processes miss
+                the same key at once, only the first one calls the function.
+                The others wait up to coalesce_timeout seconds for its
+                result instead. The first process syncs the result right
+                away, even with write_behind. Defaults to the coalesce
+                attribute.
+            key_func (Optional[callable]): Called with the function, the
+                args tuple and the kwargs dict to build the cache key
+                instead of :func:`kodiswift.common.cache_key`.
+            exclude (Optional[Iterable[str]]): The names of arguments left
+                out of the cache key, such as self or a session object.
+            namespace (Optional[Union[str, bool]]): The name of a storage
+                of its own for the results of the function, shared with the
+                other functions given the same namespace. If True, the
+                module and name of the function are used. By default the
+                results of every function go to a single storage. The
+                storage is loaded the first time the function is called.
+            max_entries (Optional[int]): The most results kept in the
+                storage of the function, see :meth:`get_storage`. A storage
+                shared by several functions is capped by the first one to
+                load it. Defaults to the function_cache_max_entries
+                attribute.
+            max_bytes (Optional[int]): Like max_entries, but caps the bytes
+                of pickled results. Defaults to the function_cache_max_bytes
+                attribute.
 
         Notes:
             ttl: For route caching, you should use
                 :meth:`kodiswift.Plugin.cached_route`.
         """
         def decorating_function(function):
-            storage = self.get_storage(
-                self._function_cache_name, file_format='pickle', ttl=ttl)
-            kwd_mark = 'f35c2d973e1bbbc61ca60fc6d7ae4eb3'
+            lock = self._cache_lock()
+            if namespace is True:
+                storage_name = self._function_cache_storage_name(
+                    '%s.%s' % (function.__module__, function.__name__))
+            else:
+                storage_name = self._function_cache_storage_name(namespace)
+            storages = []
+
+            def get_storage():
+                with lock:
+                    if not storages:
+                        # Processes which coalesce misses sync at the same
+                        # time, so they need to merge their results into the
+                        # file
+                        storages.append(self.get_storage(
+                            storage_name, file_format='pickle',
+                            ttl=ttl + (stale_ttl or 0) if ttl else None,
+                            max_entries=(self.function_cache_max_entries
+                                         if max_entries is None
+                                         else max_entries),
+                            max_bytes=(self.function_cache_max_bytes
+                                       if max_bytes is None else max_bytes),
+                            lock=(self.coalesce if coalesce is None
+                                  else coalesce)))
+                        # Cached results are never changed in place, so
+                        # syncs needn't pickle every result read to check
+                        storages[0].track_mutations = False
+                    return storages[0]
+
+            make_key = key_func or cache_key
+            if exclude:
+                excluded = frozenset(exclude)
+                excluded_positions = frozenset(
+                    i for i, name in
+                    enumerate(inspect.getargspec(function).args)
+                    if name in excluded)
+
+            def store(key, result, sync=False):
+                storage = get_storage()
+                if write_behind is None:
+                    defer = self.write_behind
+                else:
+                    defer = write_behind
+                with lock:
+                    storage[key] = result
+                    if defer and not sync:
+                        self._defer_sync(storage)
+                    else:
+                        storage.sync()
 
             @wraps(function)
             def wrapper(*args, **kwargs):
-                key = (function.__name__, kwd_mark) + args
-                if kwargs:
-                    key += (kwd_mark,) + tuple(sorted(kwargs.items()))
+                if exclude:
+                    key_args = tuple(arg for i, arg in enumerate(args)
+                                     if i not in excluded_positions)
+                    key_kwargs = dict((k, v) for k, v in kwargs.items()
+                                      if k not in excluded)
+                else:
+                    key_args, key_kwargs = args, kwargs
+
+                # Results are memoized in memory by their arguments, which
+                # is much cheaper than building the key of the storage
+                memo = self._function_memo(storage_name)
+                memo_key = (function, key_args)
+                if key_kwargs:
+                    memo_key += (tuple(sorted(key_kwargs.items())),)
+                try:
+                    result, deadline = memo[memo_key]
+                except KeyError:
+                    pass
+                except TypeError:
+                    # The arguments aren't hashable
+                    memo_key = None
+                else:
+                    if time.time() < deadline:
+                        return result
 
+                key = make_key(function, key_args, key_kwargs)
+                storage = get_storage()
                 try:
-                    result = storage[key]
-                    log.debug('Storage hit for function "%s" with args "%s" '
-                              'and kwargs "%s"', function.__name__, args,
-                              kwargs)
+                    with lock:
+                        result, timestamp = storage.entry(key)
+                    # A falsy ttl caches results forever
+                    age = time.time() - timestamp
+                    if ttl and age > (ttl + (stale_ttl or 0)) * 60:
+                        raise KeyError(key)
+                    if ttl and age > ttl * 60:
+                        if log.isEnabledFor(logging.DEBUG):
+                            log.debug('Stale storage hit for function "%s" '
+                                      'with args "%s" and kwargs "%s"',
+                                      function.__name__, args, kwargs)
+                        self._schedule_refresh(
+                            key, partial(function, *args, **kwargs),
+                            partial(store, key))
+                        return result
+                    if log.isEnabledFor(logging.DEBUG):
+                        log.debug('Storage hit for function "%s" with args '
+                                  '"%s" and kwargs "%s"', function.__name__,
+                                  args, kwargs)
                 except KeyError:
-                    log.debug('Storage miss for function "%s" with args "%s" '
-                              'and kwargs "%s"', function.__name__, args,
-                              kwargs)
-                    result = function(*args, **kwargs)
-                    storage[key] = result
-                    storage.sync()
+                    if log.isEnabledFor(logging.DEBUG):
+                        log.debug('Storage miss for function "%s" with args '
+                                  '"%s" and kwargs "%s"', function.__name__,
+                                  args, kwargs)
+                    if self.coalesce if coalesce is None else coalesce:
+                        result = self._single_flight(
+                            storage, key, partial(function, *args, **kwargs),
+                            partial(store, key, sync=True))
+                    else:
+                        result = function(*args, **kwargs)
+                        store(key, result)
+                    timestamp = time.time()
+                if memo_key is not None:
+                    deadline = timestamp + ttl * 60 if ttl else float('inf')
+                    with lock:
+                        self._memoize(memo, memo_key, result, deadline)
                 return result
 
             return wrapper
 
         return decorating_function
 
-    def clear_function_cache(self):
+    def _cache_lock(self):
+        """Returns the lock held by the function caches while they write,
+        sync or memoize, as refreshes run them from a worker thread.
+        """
+        try:
+            return self._function_cache_lock
+        except AttributeError:
+            self._function_cache_lock = threading.RLock()
+            return self._function_cache_lock
+
+    def _function_memo(self, storage_name):
+        """Returns the in memory memo of a function cache, mapping the
+        arguments of calls to their result and the time it expires.
+        """
+        try:
+            return self._function_memos[storage_name]
+        except (AttributeError, KeyError):
+            with self._cache_lock():
+                if not hasattr(self, '_function_memos'):
+                    self._function_memos = {}
+                return self._function_memos.setdefault(
+                    storage_name, collections.OrderedDict())
+
+    def _memoize(self, memo, memo_key, result, deadline):
+        """Adds a result to a memo, evicting the least recently added
+        results once it holds more than memo_size.
+        """
+        if not self.memo_size:
+            return
+        memo.pop(memo_key, None)
+        memo[memo_key] = (result, deadline)
+        while len(memo) > self.memo_size:
+            memo.popitem(last=False)
+
+    def _single_flight(self, storage, key, function, callback):
+        """Calls function and callback with its result, unless another
+        process is already calling it for the same key, in which case its
+        result is read from the storage once it is done.
+
+        A lock file under storage_path marks the key as being computed. Lock
+        files older than coalesce_timeout were left by a process which died
+        and are ignored.
+        """
+        lock_path = self._inflight_path(key)
+        deadline = time.time() + self.coalesce_timeout
+
+        while True:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            else:
+                os.close(fd)
+                try:
+                    # Another process may have cached the key since this one
+                    # read the storage
+                    try:
+                        result = self._read_coalesced(storage, key, function)
+                    except KeyError:
+                        result = function()
+                        callback(result)
+                finally:
+                    os.remove(lock_path)
+                return result
+
+            try:
+                if (time.time() - os.path.getmtime(lock_path) >
+                        self.coalesce_timeout):
+                    os.remove(lock_path)
+                    continue
+            except OSError:
+                # The other process just finished
+                pass
+            while os.path.exists(lock_path) and time.time() < deadline:
+                time.sleep(0.05)
+            if os.path.exists(lock_path):
+                log.debug('Timed out waiting for another process to cache '
+                          '"%s"', function.func.__name__)
+                self.coalesce_timeouts += 1
+                result = function()
+                callback(result)
+                return result
+
+            try:
+                return self._read_coalesced(storage, key, function)
+            except KeyError:
+                # The other process failed, try to take over
+                continue
+
+    def _read_coalesced(self, storage, key, function):
+        """Returns the result another process cached for key, reading the
+        storage again first. Raises KeyError if there is none.
+        """
+        with self._cache_lock():
+            storage.refresh()
+            result = storage[key]
+        log.debug('Another process cached "%s"', function.func.__name__)
+        self.coalesced_calls += 1
+        return result
+
+    def _inflight_path(self, key):
+        """Returns the path of the lock file which marks a cache key as being
+        computed, creating its directory if needed.
+        """
+        lock_dir = os.path.join(self.storage_path, '.inflight')
+        try:
+            os.mkdir(lock_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        return os.path.join(lock_dir, key_digest(key))
+
+    def _schedule_refresh(self, key, function, callback):
+        """Schedules function to be called by :meth:`_start_refreshes`, and
+        callback to be called with its result by :meth:`_join_refreshes`. A
+        key is only refreshed once.
+        """
+        with self._cache_lock():
+            if not hasattr(self, '_refreshes'):
+                self._refreshes = collections.OrderedDict()
+            if key not in self._refreshes:
+                self._refreshes[key] = (function, callback, None, [])
+
+    def _start_refreshes(self):
+        """Starts a worker thread calling, one after another, the refreshes
+        scheduled by stale cache hits which haven't been started yet.
+        """
+        with self._cache_lock():
+            refreshes = getattr(self, '_refreshes', None)
+            pending = [(key, function, callback, result) for
+                       key, (function, callback, thread, result)
+                       in (refreshes or {}).items() if thread is None]
+            if not pending:
+                return
+            thread = threading.Thread(
+                target=self._refresh,
+                args=([(function, result) for _, function, _, result
+                       in pending],))
+            for key, function, callback, result in pending:
+                refreshes[key] = (function, callback, thread, result)
+        thread.start()
+
+    @staticmethod
+    def _refresh(pending):
+        _refresh_state.active = True
+        try:
+            for function, result in pending:
+                try:
+                    result.append(function())
+                except Exception:
+                    log.exception('Failed to refresh a stale result of "%s"',
+                                  function.func.__name__)
+        finally:
+            _refresh_state.active = False
+
+    def _join_refreshes(self):
+        """Starts the scheduled refreshes if they weren't started by
+        :meth:`finish`, waits for them to complete and stores their results.
+        The refreshed functions may call other cached functions, which
+        write their results from the worker thread, so writes and syncs
+        of the function caches hold :meth:`_cache_lock`.
+        """
+        while True:
+            # Refreshed functions may schedule refreshes of their own
+            self._start_refreshes()
+            with self._cache_lock():
+                refreshes = getattr(self, '_refreshes', None)
+                if not refreshes:
+                    return
+                _, (_, callback, thread, result) = refreshes.popitem(
+                    last=False)
+            thread.join()
+            if result:
+                callback(result[0])
+
+    def _defer_sync(self, storage):
+        """Schedules a storage to be synced by
+        :meth:`_sync_deferred_storage`.
+        """
+        with self._cache_lock():
+            if not hasattr(self, '_deferred_storage'):
+                self._deferred_storage = {}
+            self._deferred_storage[storage.file_path] = storage
+
+    def _sync_deferred_storage(self):
+        """Syncs the storages whose sync was deferred by a write_behind
+        cache miss.
+        """
+        with self._cache_lock():
+            deferred = getattr(self, '_deferred_storage', None)
+            while deferred:
+                _, storage = deferred.popitem()
+                storage.sync()
+
+    def _function_cache_storage_name(self, namespace=None):
+        """Returns the name of the storage of a function cache namespace."""
+        if namespace is None:
+            return self._function_cache_name
+        return '%s.%s' % (self._function_cache_name, namespace)
+
+    def function_cache_namespaces(self):
+        """Returns the namespaces of the function caches which exist on disk
+        or were used in this run, None standing for the default cache.
+        """
+        prefix = self._function_cache_name + '.'
+        names = set(os.listdir(self.storage_path))
+        names.update(os.path.basename(path) for path in
+                     getattr(self, '_unsynced_storage', None) or ())
+        namespaces = set(name[len(prefix):] for name in names
+                         if name.startswith(prefix) and
+                         not name.endswith('.tmp'))
+        namespaces.discard('')
+        if self._function_cache_name in names:
+            namespaces.add(None)
+        return sorted(namespaces)
+
+    def clear_function_cache(self, namespace=None):
         """Clears the storage that caches results when using
         :meth:`kodiswift.Plugin.cached_route` or
         :meth:`kodiswift.Plugin.cached`.
+
+        Args:
+            namespace (Optional[str]): Only clear the results cached in this
+                namespace. By default every function cache is cleared.
         """
-        self.get_storage(self._function_cache_name).clear()
+        if namespace is None:
+            namespaces = self.function_cache_namespaces()
+        else:
+            namespaces = [namespace]
+        memos = getattr(self, '_function_memos', {})
+        for namespace in namespaces:
+            name = self._function_cache_storage_name(namespace)
+            self.get_storage(name).clear()
+            memos.pop(name, None)
+
+    def function_cache_sizes(self):
+        """Reports the size of every function cache.
+
+        Returns:
+            dict: The number of cached results and the size of the storage
+                file in bytes, keyed by namespace. The default cache is
+                keyed by None.
+        """
+        sizes = {}
+        for namespace in self.function_cache_namespaces():
+            name = self._function_cache_storage_name(namespace)
+            path = os.path.join(self.storage_path, name)
+            file_size = os.path.getsize(path) if os.path.exists(path) else 0
+            sizes[namespace] = (len(self.get_storage(name)), file_size)
+        return sizes
 
     def list_storage(self):
         """Returns a list of existing stores.
@@ -108,7 +526,8 @@ class XBMCMixin(object):
         return [name for name in os.listdir(self.storage_path)
                 if not name.startswith('.')]
 
-    def get_storage(self, name='main', file_format='pickle', ttl=None):
+    def get_storage(self, name='main', file_format='pickle', ttl=None,
+                    max_entries=None, max_bytes=None, lock=False):
         """Returns a storage for the given name.
 
         The returned storage is a fully functioning python dictionary and is
@@ -121,8 +540,19 @@ class XBMCMixin(object):
 
         Args:
             name (str): The name  of the storage to retrieve.
-            file_format (str): Choices are 'pickle', 'csv', and 'json'.
-                Pickle is recommended as it supports python objects.
+            file_format (str): Choices are 'pickle', 'json', 'marshal',
+                'log' and 'sqlite'. Pickle is recommended as it supports
+                python objects. The 'marshal' format is the fastest to load
+                and save, but only supports plain data such as dicts, lists,
+                strings and numbers. The 'log' format also supports python
+                objects, but only appends the keys changed since the last
+                sync to the file, which suits large storages that are synced
+                often. The 'sqlite' format returns a
+                :class:`kodiswift.storage.SQLiteStorage` which only reads
+                the values that are requested. Files built by
+                :meth:`kodiswift.storage.SnapshotStorage.build` are returned
+                as a read only :class:`kodiswift.storage.SnapshotStorage`,
+                ignoring the other arguments.
 
                 Notes: If a storage already exists for the given name, the
                     file_format parameter is ignored. The format will be
@@ -133,21 +563,53 @@ class XBMCMixin(object):
                 until a storage is loaded form disk, it is possible to call
                 get_storage() with a different TTL than when the storage was
                 created. The currently specified TTL is always honored.
+            max_entries (int): If given, the least recently used items are
+                evicted whenever the storage is loaded or synced, until it
+                holds at most this many items. Expired items are always
+                evicted first.
+            max_bytes (int): Like max_entries, but caps the size of the
+                pickled items in bytes.
+            lock (bool): Set to True if the storage is shared with other
+                processes, such as a service or a second instance of the
+                plugin. Syncs then hold a lock file and merge this process's
+                changes into the file instead of overwriting it. SQLite
+                storages always do their own locking. Once a storage is
+                locked it stays locked for the rest of the run.
 
         Returns:
-            kodiswift.storage.TimedStorage:
+            Union[kodiswift.storage.TimedStorage,
+                  kodiswift.storage.SQLiteStorage,
+                  kodiswift.storage.SnapshotStorage]:
         """
         if not hasattr(self, '_unsynced_storage'):
             self._unsynced_storage = {}
         filename = os.path.join(self.storage_path, name)
         try:
             storage = self._unsynced_storage[filename]
-            log.debug('Loaded storage "%s" from memory', name)
+            if lock and isinstance(storage, TimedStorage):
+                storage.lock = True
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug('Loaded storage "%s" from memory', name)
         except KeyError:
             if ttl:
                 ttl = timedelta(minutes=ttl)
+            file_format = detect_format(filename) or file_format
+            if file_format == Formats.SNAPSHOT:
+                # Read only, so there is nothing to expire, cap or lock
+                create_storage = partial(SnapshotStorage, filename)
+            else:
+                if file_format == Formats.SQLITE:
+                    storage_class = SQLiteStorage
+                else:
+                    storage_class = TimedStorage
+                kwargs = {'file_format': file_format,
+                          'max_entries': max_entries, 'max_bytes': max_bytes}
+                if storage_class is TimedStorage:
+                    kwargs['lock'] = lock
+                create_storage = partial(storage_class, filename, ttl,
+                                         **kwargs)
             try:
-                storage = TimedStorage(filename, ttl, file_format=file_format)
+                storage = create_storage()
                 storage.load()
             except UnknownFormat:
                 # Thrown when the storage file is corrupted and can't be read.
@@ -158,8 +620,7 @@ class XBMCMixin(object):
                     ' is recommended to clear it.', choices)
                 if ret == 0:
                     os.remove(filename)
-                    storage = TimedStorage(filename, ttl,
-                                           file_format=file_format)
+                    storage = create_storage()
                 else:
                     raise Exception('Corrupted storage file at %s' % filename)
 
@@ -180,6 +641,8 @@ class XBMCMixin(object):
 
     def set_content(self, content):
         """Sets the content type for the plugin."""
+        if getattr(_refresh_state, 'active', False):
+            return
         contents = ['files', 'songs', 'artists', 'albums', 'movies', 'tvshows',
                     'episodes', 'musicvideos']
         if content not in contents:
@@ -364,31 +827,57 @@ class XBMCMixin(object):
         _player.play(item.get_path(), item.as_xbmc_listitem())
         return [item]
 
-    def add_items(self, items):
+    def add_items(self, items, total_items=None):
         """Adds ListItems to the Kodi interface.
 
         Each item in the provided list should either be instances of
         kodiswift.ListItem, or regular dictionaries that will be passed
-        to kodiswift.ListItem.from_dict.
+        to kodiswift.ListItem.from_dicts.
+
+        A list is added at once. Items from an iterator, such as a generator
+        fetching pages from an API, are added add_items_chunk_size at a
+        time, as they come, so Kodi can show them before the last one.
 
         Args:
             items: An iterable of items where each item is either a
                 dictionary with keys/values suitable for passing to
                 :meth:`kodiswift.ListItem.from_dict` or an instance of
                 :class:`kodiswift.ListItem`.
+            total_items (Optional[int]): The number of items in the
+                listing, for Kodi to show progress with. Defaults to the
+                length of items, if it has one.
 
         Returns:
-            kodiswift.ListItem: The list of ListItems.
+            List[kodiswift.ListItem]: The ListItems added by this call, even
+                those past max_added_items, which aren't kept in
+                added_items.
         """
-        _items = [self._listitemify(item) for item in items]
-        tuples = [item.as_tuple() for item in _items if hasattr(item, 'as_tuple')]
-        xbmcplugin.addDirectoryItems(self.handle, tuples, len(tuples))
-
-        # We need to keep track internally of added items so we can return them
-        # all at the end for testing purposes
-        self.added_items.extend(_items)
+        info_type = self.info_type if hasattr(self, 'info_type') else 'video'
+        chunk_size = self.add_items_chunk_size
+        if hasattr(items, '__len__'):
+            chunk_size = max(len(items), 1)
+            if total_items is None:
+                total_items = len(items)
+        listitems = kodiswift.ListItem.from_dicts(items, info_type)
 
-        # Possibly need an if statement if only for debug mode
+        _items = []
+        chunk = list(islice(listitems, chunk_size))
+        while chunk:
+            tuples = [item.as_tuple() for item in chunk
+                      if hasattr(item, 'as_tuple')]
+            xbmcplugin.addDirectoryItems(self.handle, tuples,
+                                         total_items or 0)
+            self.added_items_count += len(tuples)
+
+            # We need to keep track internally of added items so we can
+            # return them all at the end for testing purposes
+            if self.max_added_items is None:
+                self.added_items.extend(chunk)
+            else:
+                room = self.max_added_items - len(self.added_items)
+                self.added_items.extend(chunk[:max(room, 0)])
+            _items.extend(chunk)
+            chunk = list(islice(listitems, chunk_size))
         return _items
 
     def add_sort_method(self, sort_method, label2_mask=None):
@@ -438,7 +927,8 @@ class XBMCMixin(object):
             raise Exception('Already called endOfDirectory.')
 
     def finish(self, items=None, sort_methods=None, succeeded=True,
-               update_listing=False, cache_to_disc=True, view_mode=None):
+               update_listing=False, cache_to_disc=True, view_mode=None,
+               total_items=None):
         """Adds the provided items to the Kodi interface.
 
         Args:
@@ -461,14 +951,22 @@ class XBMCMixin(object):
                 (or parsable integer string) corresponding to a view_mode or
                 the name of a type of view. Currently the only view type
                 supported is 'thumbnail'.
+            total_items (Optional[int]): The number of items, passed to
+                :meth:`add_items`. Useful when items is a generator.
 
         Returns:
             List[kodiswift.listitem.ListItem]: A list of all ListItems added
                 to the Kodi interface.
         """
+        if getattr(_refresh_state, 'active', False):
+            # A cached view refreshing a stale result, Kodi already has the
+            # listing
+            info_type = getattr(self, 'info_type', 'video')
+            return list(kodiswift.ListItem.from_dicts(items or [], info_type))
+
         # If we have any items, add them. Items are optional here.
         if items:
-            self.add_items(items)
+            self.add_items(items, total_items)
         if sort_methods:
             for sort_method in sort_methods:
                 if isinstance(sort_method, (list, tuple)):
@@ -489,6 +987,13 @@ class XBMCMixin(object):
         # Finalize the directory items
         self.end_of_directory(succeeded, update_listing, cache_to_disc)
 
+        # Kodi is displaying the listing now, so this is the time to pay for
+        # any syncs deferred by write_behind caching and to refresh the stale
+        # results which were served. The refreshes start last as they may
+        # use the storages.
+        self._sync_deferred_storage()
+        self._start_refreshes()
+
         # Return the cached list of all the list items that were added
         return self.added_items
 
@@ -1,7 +1,14 @@
 # -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import time
 import unittest
 
-from kodiswift.common import kodi_url, clean_dict, pickle_dict, unpickle_dict
+from kodiswift.common import (kodi_url, clean_dict, pickle_dict, unpickle_dict,
+                              cache_key, key_digest, encode_dict, decode_dict,
+                              JSONCodec, URLStash, url_codecs,
+                              register_url_codec)
 
 
 class TestXBMCUrl(unittest.TestCase):
@@ -54,6 +61,116 @@ class TestPickleDict(unittest.TestCase):
         self.assertEqual(unpickle_dict(pickle_dict(items)), items)
 
 
+class TestJSONCodec(unittest.TestCase):
+    def test_round_trip(self):
+        codec = JSONCodec()
+        for value in (3, 2.5, None, True, [1, 'a'], (1, (2, 3)),
+                      set([1, 2]), frozenset(['a']), {'a': {'b': [1]}},
+                      {1: 'one', (2, 3): None}, {'__t': [1]}, u'caf\xe9'):
+            data = codec.dumps(value)
+            self.assertEqual('j', data[0])
+            self.assertEqual(value, codec.loads(data))
+            self.assertEqual(type(value), type(codec.loads(data)))
+
+    def test_compression(self):
+        codec = JSONCodec()
+        value = [{'label': 'Stream', 'url': 'http://example.com/a.m3u8'}] * 20
+        data = codec.dumps(value)
+        self.assertEqual('z', data[0])
+        self.assertEqual(value, codec.loads(data))
+        self.assertTrue(len(data) < len(codec.dumps(value[:3])) * 2)
+
+        codec.max_size = 100
+        self.assertRaises(ValueError, codec.loads, data)
+        self.assertRaises(ValueError, codec.loads, 'x123')
+
+    def test_encode_dict(self):
+        items = {'name': 'jon', 'ids': [1, 2], 'number': 42,
+                 'cls': unittest.TestCase}
+        encoded = encode_dict(items)
+        self.assertEqual('jon', encoded['name'])
+        self.assertEqual('j[1,2]', encoded['ids'])
+        self.assertEqual(['ids', 'number'],
+                         sorted(encoded['_json'].split(',')))
+        # Values which JSON can't encode are pickled
+        self.assertEqual('cls', encoded['_pickled'])
+        self.assertEqual(items, decode_dict(encoded))
+        self.assertEqual({'number': 42}, decode_dict(pickle_dict(
+            {'number': 42})))
+
+
+class TestURLStash(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.stash = URLStash(os.path.join(self.temp_dir, 'stash'), 100)
+        previous = url_codecs.get(URLStash.marker)
+        register_url_codec(self.stash)
+        if previous is not None:
+            self.addCleanup(register_url_codec, previous)
+
+    def test_encode_dict(self):
+        streams = [{'url': 'http://example.com/%d.m3u8' % i}
+                   for i in range(50)]
+        items = {'streams': streams, 'ids': [1, 2], 'plot': 'x' * 200}
+        encoded = encode_dict(items, stash=self.stash)
+        self.assertEqual('j[1,2]', encoded['ids'])
+        self.assertEqual(['plot', 'streams'],
+                         sorted(encoded['_stash'].split(',')))
+        self.assertEqual(40, len(encoded['streams']))
+        self.assertEqual(items, decode_dict(encoded))
+
+        # Equal values are stashed once
+        self.assertEqual(encoded, encode_dict(items, stash=self.stash))
+        self.assertEqual(2, len(os.listdir(self.stash.path)))
+
+    def test_loads(self):
+        token = self.stash.put('', 'value')
+        self.assertEqual('value', self.stash.loads(token))
+        self.assertRaises(ValueError, self.stash.loads, '../../etc/passwd')
+        self.assertRaises(IOError, self.stash.loads, '0' * 40)
+
+    def test_sweep(self):
+        old = self.stash.put('', 'old')
+        self.stash.put('', 'new')
+        hour_ago = time.time() - 3600
+        os.utime(os.path.join(self.stash.path, old), (hour_ago, hour_ago))
+        self.assertEqual(1, self.stash.sweep(60))
+        self.assertEqual(0, self.stash.sweep(60))
+        self.assertRaises(IOError, self.stash.loads, old)
+
+
+class TestCacheKey(unittest.TestCase):
+    def test_cache_key(self):
+        def fetch():
+            pass
+
+        key = cache_key(fetch, ('a', {'x': 1, 'y': set([1, 2])}), {})
+        self.assertEqual(40, len(key))
+        # Equal arguments give the same key, whatever their order
+        self.assertEqual(key, cache_key(
+            fetch, ('a', {'y': set([2, 1]), 'x': 1}), {}))
+        self.assertNotEqual(key, cache_key(fetch, ('a',), {'x': 1}))
+
+        def other():
+            pass
+
+        self.assertNotEqual(cache_key(fetch, (), {}),
+                            cache_key(other, (), {}))
+        other.__name__ = 'fetch'
+        other.__module__ = 'another.module'
+        self.assertNotEqual(cache_key(fetch, (), {}),
+                            cache_key(other, (), {}))
+
+    def test_key_digest(self):
+        key = key_digest(('drama', 'drama'))
+        self.assertEqual(40, len(key))
+        # Whether or not the strings are the same object
+        self.assertEqual(key, key_digest((''.join(['dra', 'ma']),
+                                          ''.join(['dr', 'ama']))))
+        self.assertNotEqual(key, key_digest(('drama', 'comedy')))
+
+
 class TestDownloadPage(unittest.TestCase):
     def test_download_page(self):
         pass
@@ -122,6 +122,8 @@ class TestListItem(unittest.TestCase):
                                'setInfo') as mock_setInfo:
             item = ListItem()
             item.set_info('video', {'title': '300'})
+            self.assertFalse(mock_setInfo.called)
+            item.as_xbmc_listitem()
         mock_setInfo.assert_called_with('video', {'title': '300'})
 
     def test_stream_info(self):
@@ -130,6 +132,7 @@ class TestListItem(unittest.TestCase):
                                'addStreamInfo') as mock_stream_info:
             item = ListItem()
             item.add_stream_info('video', {'duration': 185})
+            item.as_xbmc_listitem()
             mock_stream_info.assert_called_with('video', {'duration': 185})
             item.add_stream_info('audio', {'language': 'en'})
             mock_stream_info.assert_called_with('audio', {'language': 'en'})
@@ -148,17 +151,16 @@ class TestListItem(unittest.TestCase):
         self.assertEqual(item.is_selected(), False)
 
     def test_select_getter(self):
-        # noinspection PyUnresolvedReferences
-        with mock.patch.object(xbmcgui.ListItem, 'isSelected') as mock_selected:
-            mock_selected.return_value = False
-            item = ListItem()
-            self.assertEqual(item.selected, False)
-        mock_selected.assert_called_with()
+        item = ListItem()
+        self.assertEqual(item.selected, False)
+        item.selected = True
+        self.assertEqual(item.as_xbmc_listitem().isSelected(), True)
 
     def test_select_setter(self):
         # noinspection PyUnresolvedReferences
         with mock.patch.object(xbmcgui.ListItem, 'select') as mock_select:
             item = ListItem()
+            item.as_xbmc_listitem()
             item.selected = True
             mock_select.assert_called_with(True)
             item.selected = False
@@ -169,28 +171,29 @@ class TestListItem(unittest.TestCase):
         with mock.patch.object(xbmcgui.ListItem, 'select') as mock_select:
             item = ListItem()
             item.selected = True
+            item.as_xbmc_listitem()
             mock_select.assert_called_with(True)
             item.select(False)
             mock_select.assert_called_with(False)
 
     def test_is_selected(self):
-        # noinspection PyUnresolvedReferences
-        with mock.patch.object(xbmcgui.ListItem, 'isSelected') as mock_selected:
-            mock_selected.return_value = False
-            item = ListItem()
-            self.assertEqual(item.is_selected(), False)
-        mock_selected.assert_called_with()
+        item = ListItem()
+        self.assertEqual(item.is_selected(), False)
+        item.as_xbmc_listitem()
+        item.select(True)
+        self.assertEqual(item.as_xbmc_listitem().isSelected(), True)
 
-    @mock.patch('kodiswift.xbmcgui.ListItem.getProperty')
-    def test_get_property(self, mock_get_property):
-        mock_get_property.return_value = 'bar'
+    def test_get_property(self):
         item = ListItem()
+        self.assertEqual(item.get_property('foo'), '')
+        item.set_property('Foo', 'bar')
         self.assertEqual(item.get_property('foo'), 'bar')
-        mock_get_property.assert_called_with('foo')
+        self.assertEqual(item.as_xbmc_listitem().getProperty('foo'), 'bar')
 
     @mock.patch('kodiswift.xbmcgui.ListItem.setProperty')
     def test_set_property(self, mock_set_property):
         item = ListItem()
+        item.as_xbmc_listitem()
         item.set_property('foo', 'bar')
         mock_set_property.assert_called_with('foo', 'bar')
 
@@ -198,6 +201,27 @@ class TestListItem(unittest.TestCase):
         item = ListItem()
         self.assertEqual(item.as_tuple(), (None, item._listitem, True))
 
+    def test_lazy_listitem(self):
+        with mock.patch('kodiswift.xbmcgui.ListItem') as xbmc_listitem:
+            item = ListItem('label', path='path')
+            item.label2 = 'label2'
+            item.thumbnail = 'thumb'
+            item.playable = True
+            self.assertFalse(xbmc_listitem.called)
+
+            self.assertIs(item.as_xbmc_listitem(), item.as_tuple()[1])
+        xbmc_listitem.assert_called_once_with(label='label', label2='label2',
+                                              path='path')
+        listitem = xbmc_listitem.return_value
+        listitem.setArt.assert_called_once_with({'icon': None,
+                                                 'thumb': 'thumb'})
+        listitem.setProperties.assert_called_once_with(
+            {'isplayable': 'true'})
+
+        item.label = 'new label'
+        listitem.setLabel.assert_called_once_with('new label')
+        self.assertFalse(hasattr(item, '__dict__'))
+
 
     def test___str__(self):
         item = ListItem()
@@ -282,3 +306,45 @@ class TestFromDict(unittest.TestCase):
                                spec=False) as mock_set_info:
             _ = ListItem.from_dict(**dct)
         mock_set_info.assert_called_with('video', {'title': 'My title'})
+
+    def test_from_dicts(self):
+        dcts = [
+            {'label': 'foo', 'path': 'plugin://my.plugin.id/foo',
+             'icon': 'icon', 'fanart': 'fanart', 'selected': True,
+             'info': {'title': 'My title'},
+             'properties': [('StartOffset', '256.4')],
+             'stream_info': {'video': {'duration': 185}},
+             'context_menu': [('label', 'action')], 'is_playable': True},
+            {'label': 'bar', 'label2': 'baz', 'info_type': 'music',
+             'properties': {'isPlayable': 'false'}},
+        ]
+        listitem = ListItem('qux')
+        items = list(ListItem.from_dicts(dcts + [listitem], 'pictures'))
+
+        self.assertEqual(items[:2], [ListItem.from_dict(**dct)
+                                     for dct in dcts])
+        self.assertIs(items[2], listitem)
+
+        item = items[0]
+        self.assertEqual(item.art['fanart'], 'fanart')
+        self.assertEqual(item.get_property('StartOffset'), '256.4')
+        self.assertEqual(item.get_property('isPlayable'), 'true')
+        self.assertEqual(item.get_context_menu_items(), [('label', 'action')])
+        self.assertFalse(item.is_folder)
+        self.assertEqual(item.as_xbmc_listitem().stream_info,
+                         {'video': {'duration': 185}})
+        self.assertEqual(item.as_xbmc_listitem().infolabels,
+                         {'title': 'My title'})
+        self.assertEqual(items[1].get_property('isPlayable'), 'false')
+        self.assertTrue(items[1].is_folder)
+
+    def test_from_dicts_info_type(self):
+        dcts = [{'info': {'title': 'foo'}},
+                {'info': {'title': 'bar'}, 'info_type': 'music'}]
+        with mock.patch('kodiswift.xbmcgui.ListItem.setInfo') as set_info:
+            for item in ListItem.from_dicts(dcts, 'pictures'):
+                item.as_xbmc_listitem()
+        self.assertEqual(set_info.call_args_list, [
+            mock.call('pictures', {'title': 'foo'}),
+            mock.call('music', {'title': 'bar'}),
+        ])
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import logging
+import unittest
+
+from mock import Mock, patch
+
+from kodiswift import logger
+from kodiswift.logger import (XBMCFilter, XBMCHandler, kodi_debug_enabled,
+                              set_log_level, setup_log)
+
+
+class TestXBMCFilter(unittest.TestCase):
+    def make_record(self, level):
+        record = logging.LogRecord('test', level, __file__, 1, 'msg %s',
+                                   ('arg',), None)
+        record.getMessage = Mock(return_value='msg arg')
+        return record
+
+    @patch('kodiswift.xbmc.log')
+    def test_cli_mode(self, xbmc_log):
+        record = self.make_record(logging.DEBUG)
+        self.assertTrue(XBMCFilter('[test] ').filter(record))
+        self.assertFalse(xbmc_log.called)
+
+    @patch('kodiswift.logger.CLI_MODE', False)
+    @patch('kodiswift.logger._kodi_debug', False)
+    @patch('kodiswift.xbmc.log')
+    def test_kodi_debug_off(self, xbmc_log):
+        log_filter = XBMCFilter('[test] ')
+        record = self.make_record(logging.DEBUG)
+        self.assertFalse(log_filter.filter(record))
+        self.assertFalse(record.getMessage.called)
+        self.assertFalse(xbmc_log.called)
+
+        self.assertFalse(log_filter.filter(self.make_record(logging.INFO)))
+        xbmc_log.assert_called_once_with('[test] msg arg', 2)
+
+    @patch('kodiswift.logger.CLI_MODE', False)
+    @patch('kodiswift.logger._kodi_debug', True)
+    @patch('kodiswift.xbmc.log')
+    def test_kodi_debug_on(self, xbmc_log):
+        self.assertFalse(XBMCFilter('[test] ').filter(
+            self.make_record(logging.DEBUG)))
+        xbmc_log.assert_called_once_with('[test] msg arg', 0)
+
+
+class TestXBMCHandler(unittest.TestCase):
+    @patch('kodiswift.logger._kodi_debug', False)
+    @patch('kodiswift.xbmc.log')
+    def test_emit(self, xbmc_log):
+        handler = XBMCHandler('[test] ')
+        record = logging.LogRecord('test', logging.DEBUG, __file__, 1,
+                                   'msg %s', ('arg',), None)
+        handler.handle(record)
+        self.assertFalse(xbmc_log.called)
+
+        record.levelno, record.levelname = logging.WARNING, 'WARNING'
+        handler.handle(record)
+        xbmc_log.assert_called_once_with('[test] msg arg', 3)
+
+
+class TestSetupLog(unittest.TestCase):
+    def test_idempotent(self):
+        name = 'plugin.video.test_idempotent'
+        _log = setup_log(name)
+        self.assertIs(_log, setup_log(name))
+        self.assertEqual(1, len(_log.handlers))
+        self.assertEqual([], _log.filters)
+
+    @patch('kodiswift.logger.CLI_MODE', False)
+    @patch('kodiswift.xbmc.log')
+    def test_kodi_mode(self, xbmc_log):
+        _log = setup_log('plugin.video.test_kodi_mode')
+        setup_log('plugin.video.test_kodi_mode')
+        self.assertEqual(1, len(_log.handlers))
+        self.assertIsInstance(_log.handlers[0], XBMCHandler)
+        self.assertFalse(_log.propagate)
+
+        _log.warning('msg %s', 'arg')
+        xbmc_log.assert_called_once_with(
+            '[plugin.video.test_kodi_mode] msg arg', 3)
+
+
+class TestKodiDebugEnabled(unittest.TestCase):
+    @patch('kodiswift.logger._kodi_debug', None)
+    def test_asks_once(self):
+        with patch('kodiswift.xbmc.executeJSONRPC', create=True,
+                   return_value='{"result": {"value": false}}') as rpc:
+            self.assertFalse(kodi_debug_enabled())
+            self.assertFalse(kodi_debug_enabled())
+        self.assertEqual(1, rpc.call_count)
+
+    @patch('kodiswift.logger._kodi_debug', None)
+    def test_unknown(self):
+        with patch('kodiswift.xbmc.executeJSONRPC', create=True,
+                   return_value='{"error": {"code": -32602}}'):
+            self.assertTrue(kodi_debug_enabled())
+
+
+class TestSetLogLevel(unittest.TestCase):
+    def setUp(self):
+        level = logger.GLOBAL_LOG_LEVEL
+        self.addCleanup(set_log_level, level)
+
+    def test_set_log_level(self):
+        plugin_log = logger.setup_log('plugin.video.test_set_log_level')
+        set_log_level('warning')
+        self.assertEqual(logging.WARNING, logger.GLOBAL_LOG_LEVEL)
+        self.assertEqual(logging.WARNING, plugin_log.level)
+        self.assertEqual(logging.WARNING, logger.log.level)
+        self.assertFalse(plugin_log.isEnabledFor(logging.INFO))
+
+        set_log_level(logging.DEBUG)
+        self.assertTrue(plugin_log.isEnabledFor(logging.DEBUG))
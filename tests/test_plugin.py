@@ -8,7 +8,7 @@ from unittest import TestCase
 from mock import patch
 
 import kodiswift
-from kodiswift import Plugin
+from kodiswift import Plugin, Request
 from kodiswift.mockxbmc.xbmc import TEMP_DIR
 from utils import preserve_cli_mode, preserve_cwd
 
@@ -34,6 +34,7 @@ class TestInit(TestCase):
         self.assertEqual(plugin.info_type, 'video')
         self.assertTrue(os.path.isdir(plugin.storage_path))
         self.assertEqual(plugin.added_items, [])
+        self.assertIsNone(plugin.max_added_items)
         self.assertRaises(Exception, getattr, plugin, 'handle')
         self.assertRaises(Exception, getattr, plugin, 'request')
         # Test loading from strings.po
@@ -76,11 +77,14 @@ class TestInit(TestCase):
         with preserve_cwd(os.path.dirname(path)):
             with preserve_cli_mode(cli_mode=False):
                 plugin = Plugin(name, plugin_id, path)
+                kept = Plugin(name, plugin_id, path, keep_added_items=True)
 
         self.assertEqual(plugin_id, plugin.id)
         self.assertEqual(plugin.name, name)
         self.assertTrue(os.path.isdir(plugin.storage_path))
         self.assertEqual(plugin.added_items, [])
+        self.assertEqual(0, plugin.max_added_items)
+        self.assertIsNone(kept.max_added_items)
         self.assertRaises(Exception, getattr, plugin, 'handle')
         self.assertRaises(Exception, getattr, plugin, 'request')
 
@@ -214,6 +218,17 @@ class TestBasicRouting(TestCase):
                          'plugin://plugin.video.hellokodi/?foo=bar')
         self.assertEqual(plugin.url_for('main_menu', foo=3),
                          'plugin://plugin.video.hellokodi/?foo=3')
+        url = plugin.url_for('main_menu', ids=[1, 2])
+        self.assertEqual(url, 'plugin://plugin.video.hellokodi/'
+                              '?_json=ids&ids=j%5B1%2C2%5D')
+        self.assertEqual({'ids': [[1, 2]]}, Request(url, '0').args)
+
+        # Large values are stashed, leaving a short URL
+        streams = [{'url': 'http://example.com/%d.m3u8' % i}
+                   for i in range(500)]
+        url = plugin.url_for('main_menu', streams=streams)
+        self.assertTrue(len(url) < 200)
+        self.assertEqual({'streams': [streams]}, Request(url, '0').args)
 
     def test_url_for_multiple_routes(self):
         plugin = new_plugin()
@@ -231,6 +246,32 @@ class TestBasicRouting(TestCase):
                          'plugin://plugin.video.hellokodi/?foo=3')
         self.assertEqual(plugin.url_for('videos'),
                          'plugin://plugin.video.hellokodi/videos/')
+        # The first route registered for a function is used by url_for
+        self.assertEqual(plugin.url_for(main_menu),
+                         'plugin://plugin.video.hellokodi/videos/')
+
+    def test_keep_added_items(self):
+        name = 'Hello Kodi'
+        plugin_id = 'plugin.video.hellokodi'
+        path = os.path.join(os.path.dirname(__file__), 'data', 'plugin',
+                            'plugin.py')
+        with preserve_cwd(os.path.dirname(path)):
+            plugin = Plugin(name, plugin_id, path, keep_added_items=False)
+
+        @plugin.route('/')
+        def main_menu():
+            return [{'label': 'Item %d' % i} for i in range(120)]
+
+        sys.argv = ['plugin://%s/' % plugin.id, '0', '?']
+        with patch('kodiswift.xbmcplugin.addDirectoryItems') as add_items:
+            self.assertEqual([], plugin.run())
+        self.assertEqual([], plugin.added_items)
+        self.assertEqual(120, plugin.added_items_count)
+        self.assertEqual([120],
+                         [len(c[0][1]) for c in add_items.call_args_list])
+
+        plugin.clear_added_items()
+        self.assertEqual(0, plugin.added_items_count)
 
     def test_options(self):
         plugin = new_plugin()
@@ -274,6 +315,24 @@ class TestBasicRouting(TestCase):
             resp = test_run('/')
             self.assertEqual('Hello chris', resp[0].get_label())
 
+    def test_routes_added_after_dispatch(self):
+        plugin = new_plugin()
+
+        @plugin.route('/')
+        def main_menu():
+            return [{'label': 'Hello Kodi'}]
+
+        with preserve_cli_mode(cli_mode=False):
+            test_run = _test_plugin_runner(plugin)
+            test_run('/')
+
+            @plugin.route('/videos/')
+            def videos():
+                return [{'label': 'Hello Videos'}]
+
+            resp = test_run('/videos/')
+            self.assertEqual('Hello Videos', resp[0].get_label())
+
     def test_redirect(self):
         plugin = new_plugin()
 
@@ -314,6 +373,28 @@ class TestUnsyncedCaches(TestCase):
         self.assertEqual(synced['foo'][0], 'bar')
 
 
+    def test_read_only_storage_is_not_written(self):
+        plugin = new_plugin()
+
+        @plugin.route('/')
+        def write():
+            plugin.get_storage('read_only')['foo'] = 'bar'
+
+        @plugin.route('/read/')
+        def read():
+            self.assertEqual('bar', plugin.get_storage('read_only')['foo'])
+
+        sys.argv = ['plugin://plugin.video.hellokodi/', '1', '?']
+        plugin.run()
+
+        plugin = new_plugin()
+        plugin.route('/read/')(read)
+        sys.argv = ['plugin://plugin.video.hellokodi/read/', '1', '?']
+        plugin.run()
+        storage = plugin.get_storage('read_only')
+        self.assertEqual((0, 1), (storage.writes, storage.skipped_writes))
+
+
 class TestResolvedUrl(TestCase):
     def test_url_was_resolved(self):
         plugin = new_plugin()
@@ -42,3 +42,22 @@ class TestRequest(unittest.TestCase):
         self.assertEqual(request.scheme, 'plugin')
         self.assertEqual(request.netloc, 'plugin.video.helloxbmc')
         self.assertEqual(request.path, '/')
+
+    def test_lazy_args(self):
+        request = Request('plugin://plugin.video.helloxbmc/?foo=I3%0A.'
+                          '&bar=not+a+pickle&baz=x;empty=&_pickled=foo%2Cbar',
+                          '0')
+        # A value is only unpickled when it is read
+        self.assertEqual([3], request.args['foo'])
+        self.assertEqual(['x'], request.args.get('baz'))
+        self.assertEqual(['bar', 'baz', 'foo'], sorted(request.args))
+        self.assertRaises(Exception, request.args.__getitem__, 'bar')
+        del request.args['bar']
+        request.args['qux'] = ['1']
+        self.assertEqual({'foo': [3], 'baz': ['x'], 'qux': ['1']},
+                         request.args)
+
+    def test_encoded_qs_args(self):
+        request = Request('plugin://plugin.video.helloxbmc/?ids=j%5B1%2C2%5D'
+                          '&foo=I3%0A.&_json=ids&_pickled=foo', '0')
+        self.assertEqual({'ids': [[1, 2]], 'foo': [3]}, request.args)
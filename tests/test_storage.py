@@ -1,10 +1,17 @@
 # -*- coding: utf-8 -*-
+import os
+import pickle
+import shutil
+import sqlite3
+import tempfile
 import time
 import unittest
 from datetime import timedelta
 from tempfile import NamedTemporaryFile
 
-from kodiswift.storage import TimedStorage, PersistentStorage, Formats
+from kodiswift.storage import (TimedStorage, PersistentStorage, Formats,
+                               SnapshotStorage, SQLiteStorage, UnknownFormat,
+                               detect_format)
 
 
 class TestCache(unittest.TestCase):
@@ -43,8 +50,203 @@ class TestCache(unittest.TestCase):
             self.assertEqual('jon', storage2.pop('name'))
             self.assertEqual('42', storage2['answer'])
 
+    def test_marshal(self):
+        with NamedTemporaryFile() as temp:
+            storage = PersistentStorage(temp.name, Formats.MARSHAL)
+            storage['name'] = 'jon'
+            storage.update({'answer': 42, ('a', 1): [{'b': None}]})
+            storage.close()
+            self.assertEqual(Formats.MARSHAL, detect_format(temp.name))
+
+            storage2 = PersistentStorage(temp.name)
+            storage2.load()
+            self.assertEqual(Formats.MARSHAL, storage2.file_format)
+            self.assertEqual(storage, storage2)
+
+    def test_detect_format(self):
+        with NamedTemporaryFile() as temp:
+            for file_format in (Formats.PICKLE, Formats.JSON, Formats.LOG,
+                                Formats.MARSHAL):
+                storage = PersistentStorage(temp.name, file_format)
+                storage['name'] = 'jon'
+                storage.close()
+                self.assertEqual(file_format, detect_format(temp.name))
+
+    def test_load_legacy_pickle(self):
+        with NamedTemporaryFile() as temp:
+            with open(temp.name, 'wb') as f:
+                pickle.dump({'name': 'jon'}, f, 0)
+            self.assertEqual(None, detect_format(temp.name))
+            storage = PersistentStorage(temp.name)
+            storage.load()
+            self.assertEqual({'name': 'jon'}, dict(storage))
+
+    def test_log(self):
+        with NamedTemporaryFile() as temp:
+            storage = PersistentStorage(temp.name, Formats.LOG)
+            storage['name'] = 'jon'
+            storage.update({'answer': 42, 'list': [1, 2]})
+            storage.sync()
+            size = os.path.getsize(temp.name)
+
+            # Only the changed and deleted keys are appended
+            storage['answer'] = 43
+            del storage['list']
+            storage.close()
+            self.assertTrue(os.path.getsize(temp.name) > size)
+
+            storage2 = PersistentStorage(temp.name)
+            storage2.load()
+            self.assertEqual(Formats.LOG, storage2.file_format)
+            self.assertEqual({'name': 'jon', 'answer': 43}, dict(storage2))
+
+    def test_log_compaction(self):
+        with NamedTemporaryFile() as temp:
+            storage = PersistentStorage(temp.name, Formats.LOG)
+            storage.log_compact_min_bytes = 0
+            storage['name'] = 'jon'
+            storage.sync()
+            for i in range(5):
+                storage['answer'] = i
+                storage.sync()
+            storage.close()
+
+            storage2 = PersistentStorage(temp.name, Formats.LOG)
+            storage2.load()
+            self.assertEqual({'name': 'jon', 'answer': 4}, dict(storage2))
+            self.assertEqual(os.path.getsize(temp.name), storage2._log_size)
+            storage2.compact()
+            self.assertEqual(0, storage2._log_dead)
+            self.assertEqual(os.path.getsize(temp.name), storage2._log_size)
+
+    def test_log_torn_record(self):
+        with NamedTemporaryFile() as temp:
+            storage = PersistentStorage(temp.name, Formats.LOG)
+            storage['name'] = 'jon'
+            storage.sync()
+            storage['answer'] = 42
+            storage.close()
+            with open(temp.name, 'r+b') as f:
+                f.truncate(os.path.getsize(temp.name) - 2)
+
+            storage2 = PersistentStorage(temp.name, Formats.LOG)
+            storage2.load()
+            self.assertEqual({'name': 'jon'}, dict(storage2))
+            storage2['answer'] = 41
+            storage2.close()
+
+            storage3 = PersistentStorage(temp.name, Formats.LOG)
+            storage3.load()
+            self.assertEqual({'name': 'jon', 'answer': 41}, dict(storage3))
+
+    def test_dirty(self):
+        with NamedTemporaryFile() as temp:
+            storage = PersistentStorage(temp.name)
+            self.assertFalse(storage.dirty)
+            storage['people'] = ['jon']
+            storage['answer'] = 42
+            self.assertTrue(storage.dirty)
+            storage.close()
+            self.assertFalse(storage.dirty)
+            self.assertEqual(1, storage.writes)
+
+            storage2 = PersistentStorage(temp.name)
+            storage2.load()
+            self.assertEqual(42, storage2['answer'])
+            self.assertEqual(['jon'], storage2['people'])
+            self.assertFalse(storage2.dirty)
+            storage2.close()
+            self.assertEqual((0, 1),
+                             (storage2.writes, storage2.skipped_writes))
+
+    def test_dirty_in_place_mutation(self):
+        with NamedTemporaryFile() as temp:
+            storage = TimedStorage(temp.name)
+            storage['people'] = ['jon']
+            storage.close()
+
+            storage2 = TimedStorage(temp.name)
+            storage2.load()
+            storage2['people'].append('dave')
+            self.assertTrue(storage2.dirty)
+            storage2.close()
+            self.assertEqual(1, storage2.writes)
+
+            storage3 = TimedStorage(temp.name)
+            storage3.load()
+            self.assertEqual(['jon', 'dave'], storage3['people'])
+
+    def test_untracked_mutation(self):
+        with NamedTemporaryFile() as temp:
+            storage = TimedStorage(temp.name)
+            storage['people'] = ['jon']
+            storage.close()
+
+            storage2 = TimedStorage(temp.name)
+            storage2.track_mutations = False
+            storage2.load()
+            storage2['people'].append('dave')
+            self.assertEqual({}, storage2._snapshots)
+            self.assertFalse(storage2.dirty)
+            storage2.close()
+            self.assertEqual((0, 1),
+                             (storage2.writes, storage2.skipped_writes))
+
     def test_load_raise_on_corrupt_file(self):
-        pass
+        with NamedTemporaryFile() as temp:
+            with open(temp.name, 'wb') as f:
+                f.write('\x80\x02 not a pickle')
+            storage = PersistentStorage(temp.name)
+            self.assertRaises(UnknownFormat, storage.load)
+
+    def test_locked_sync_merges(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        for file_format in (Formats.PICKLE, Formats.LOG):
+            path = os.path.join(temp_dir, file_format)
+            first = PersistentStorage(path, file_format, lock=True)
+            first['shared'] = 1
+            first['gone'] = 1
+            first.sync()
+
+            # Two processes with the same file loaded
+            second = PersistentStorage(path, file_format, lock=True)
+            second.load()
+            first['first'] = 1
+            del first['gone']
+            first.sync()
+            second['second'] = 2
+            second['shared'] = 2
+            second.sync()
+
+            expected = {'first': 1, 'second': 2, 'shared': 2}
+            self.assertEqual(expected, dict(second))
+            reloaded = PersistentStorage(path, file_format)
+            reloaded.load()
+            self.assertEqual(expected, dict(reloaded))
+            self.assertTrue(os.path.exists(
+                os.path.join(temp_dir, '.' + file_format + '.lock')))
+
+    def test_locked_log_merges_after_compaction(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        path = os.path.join(temp_dir, 'log')
+        first = PersistentStorage(path, Formats.LOG, lock=True)
+        first['a'] = 1
+        first.sync()
+        second = PersistentStorage(path, Formats.LOG, lock=True)
+        second.load()
+
+        # Replaces the file, so the second storage has to reload all of it
+        first['b'] = 2
+        first.sync()
+        first.compact()
+        second['c'] = 3
+        second.sync()
+
+        reloaded = PersistentStorage(path)
+        reloaded.load()
+        self.assertEqual({'a': 1, 'b': 2, 'c': 3}, dict(reloaded))
 
     def test_load_non_existing_file(self):
         pass
@@ -104,3 +306,270 @@ class TestTimedStorage(unittest.TestCase):
                                 file_format=Formats.JSON)
         storage4.load()
         self.assertEqual(sorted(storage3.items()), sorted(storage4.items()))
+
+    def test_purge_expired(self):
+        with NamedTemporaryFile() as temp:
+            storage = TimedStorage(temp.name, 60)
+            self.assertEqual(60.0, storage._ttl_seconds)
+            storage['fresh'] = 1
+            storage['stale'] = 2
+            storage['staler'] = 3
+            storage._store['stale'] = (2, time.time() - 61)
+            storage._store['staler'] = (3, time.time() - 3600)
+            self.assertEqual(2, storage.purge_expired())
+            self.assertEqual(['fresh'], storage.keys())
+            self.assertEqual(0, storage.purge_expired())
+
+            storage.ttl = timedelta(hours=2)
+            self.assertEqual(7200.0, storage._ttl_seconds)
+            storage.ttl = None
+            self.assertEqual(0, storage.purge_expired())
+
+    def test_max_entries(self):
+        with NamedTemporaryFile() as temp:
+            storage = TimedStorage(temp.name, max_entries=2)
+            storage['a'] = 1
+            storage['b'] = 2
+            storage['c'] = 3
+            # Reading 'a' makes 'b' the least recently used entry
+            self.assertEqual(1, storage['a'])
+            storage.sync()
+            self.assertEqual(['a', 'c'], sorted(storage.keys()))
+            self.assertEqual(1, storage.last_sweep[0])
+            self.assertTrue(storage.last_sweep[1] > 0)
+
+            storage2 = TimedStorage(temp.name, max_entries=1)
+            storage2.load()
+            self.assertEqual(['c'], storage2.keys())
+
+    def test_max_bytes(self):
+        with NamedTemporaryFile() as temp:
+            storage = TimedStorage(temp.name, timedelta(hours=1))
+            storage['old'] = 'x' * 100
+            storage['new'] = 'y' * 100
+            storage['expired'] = 'z'
+            storage._store['old'] = ('x' * 100, time.time() - 60)
+            storage._store['expired'] = ('z', time.time() - 7200)
+            storage.close()
+
+            storage2 = TimedStorage(temp.name, timedelta(hours=1),
+                                    max_bytes=150)
+            storage2.load()
+            self.assertEqual(['new'], storage2.keys())
+            self.assertEqual(2, storage2.last_sweep[0])
+            self.assertTrue(storage2.dirty)
+
+
+class TestSQLiteStorage(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.temp_dir, 'storage')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_sqlite(self):
+        storage = SQLiteStorage(self.file_path)
+        storage.load()
+        storage['name'] = 'jon'
+        storage.update({'answer': 42, ('a', 1): [1, 2]})
+        self.assertEqual(42, storage['answer'])
+        storage.close()
+        self.assertEqual(Formats.SQLITE, detect_format(self.file_path))
+
+        storage2 = SQLiteStorage(self.file_path)
+        storage2.load()
+        self.assertEqual(sorted(storage.items()), sorted(storage2.items()))
+        self.assertEqual(3, len(storage2))
+        self.assertEqual([1, 2], storage2[('a', 1)])
+        del storage2['name']
+        self.assertRaises(KeyError, storage2.__getitem__, 'name')
+        storage2.close()
+
+        storage3 = SQLiteStorage(self.file_path)
+        storage3.load()
+        self.assertEqual(['answer', ('a', 1)], sorted(storage3))
+
+    def test_equal_keys(self):
+        with SQLiteStorage(self.file_path) as storage:
+            storage[('drama', 'drama')] = 42
+
+        # Equal to the stored key, but made of two distinct strings
+        key = (''.join(['dra', 'ma']), ''.join(['dr', 'ama']))
+        with SQLiteStorage(self.file_path) as storage2:
+            self.assertTrue(key in storage2)
+            self.assertEqual(42, storage2[key])
+            del storage2[key]
+
+        storage3 = SQLiteStorage(self.file_path)
+        storage3.load()
+        self.assertEqual([], list(storage3))
+
+    def test_values_loaded_on_demand(self):
+        with SQLiteStorage(self.file_path) as storage:
+            storage['name'] = 'jon'
+            storage['answer'] = 42
+
+        storage2 = SQLiteStorage(self.file_path)
+        storage2.load()
+        self.assertEqual({}, storage2._cache)
+        self.assertEqual('jon', storage2['name'])
+        self.assertEqual(['name'], storage2._cache.keys())
+
+    def test_in_place_mutation(self):
+        with SQLiteStorage(self.file_path) as storage:
+            storage['people'] = ['jon']
+
+        with SQLiteStorage(self.file_path) as storage2:
+            storage2['people'].append('dave')
+
+        storage3 = SQLiteStorage(self.file_path)
+        storage3.load()
+        self.assertEqual(['jon', 'dave'], storage3['people'])
+
+    def test_untracked_mutation(self):
+        with SQLiteStorage(self.file_path) as storage:
+            storage['people'] = ['jon']
+
+        with SQLiteStorage(self.file_path) as storage2:
+            storage2.track_mutations = False
+            storage2['people'].append('dave')
+            self.assertFalse(storage2.dirty)
+        self.assertEqual((0, 1), (storage2.writes, storage2.skipped_writes))
+
+        storage3 = SQLiteStorage(self.file_path)
+        storage3.load()
+        self.assertEqual(['jon'], storage3['people'])
+
+    def test_ttl(self):
+        with SQLiteStorage(self.file_path) as storage:
+            storage['name'] = 'jon'
+
+        conn = sqlite3.connect(self.file_path)
+        with conn:
+            conn.execute('UPDATE storage SET timestamp = timestamp - 10')
+        conn.close()
+
+        storage2 = SQLiteStorage(self.file_path, timedelta(seconds=5))
+        storage2.load()
+        self.assertEqual([], storage2.items())
+        self.assertRaises(KeyError, storage2.__getitem__, 'name')
+
+    def test_clear(self):
+        with SQLiteStorage(self.file_path) as storage:
+            storage['name'] = 'jon'
+
+        with SQLiteStorage(self.file_path) as storage2:
+            storage2.clear()
+            storage2['answer'] = 42
+
+        storage3 = SQLiteStorage(self.file_path)
+        storage3.load()
+        self.assertEqual([('answer', 42)], storage3.items())
+
+    def test_dirty(self):
+        with SQLiteStorage(self.file_path) as storage:
+            storage['people'] = ['jon']
+            self.assertTrue(storage.dirty)
+        self.assertEqual(1, storage.writes)
+
+        with SQLiteStorage(self.file_path) as storage2:
+            self.assertEqual(['jon'], storage2['people'])
+            self.assertFalse(storage2.dirty)
+        self.assertEqual((0, 1), (storage2.writes, storage2.skipped_writes))
+
+        with SQLiteStorage(self.file_path) as storage3:
+            storage3['people'].append('dave')
+            self.assertTrue(storage3.dirty)
+        self.assertEqual(1, storage3.writes)
+
+    def test_max_entries(self):
+        with SQLiteStorage(self.file_path) as storage:
+            for i in range(5):
+                storage[i] = 'x' * 100
+                storage.sync()
+
+        storage2 = SQLiteStorage(self.file_path, max_entries=3)
+        storage2.load()
+        self.assertEqual([2, 3, 4], sorted(storage2))
+        self.assertEqual(2, storage2.last_sweep[0])
+
+        storage3 = SQLiteStorage(self.file_path, max_bytes=250)
+        storage3.load()
+        self.assertEqual([3, 4], sorted(storage3))
+
+    def test_corrupt_file(self):
+        with open(self.file_path, 'wb') as f:
+            f.write('not a database' * 100)
+        storage = SQLiteStorage(self.file_path)
+        self.assertRaises(UnknownFormat, storage.load)
+
+
+class TestSnapshotStorage(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.temp_dir, 'snapshot')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_build_and_read(self):
+        shared = 'drama' * 2
+        items = {'drama': ['a', 'b'], ('genre', shared): {'x': 1}, 42: None}
+        self.assertEqual(3, SnapshotStorage.build(self.file_path, items))
+        self.assertEqual(Formats.SNAPSHOT, detect_format(self.file_path))
+
+        with SnapshotStorage(self.file_path) as storage:
+            self.assertEqual(3, len(storage))
+            self.assertEqual(items, dict(storage))
+            # The key is found no matter which of its objects are shared
+            key = ('genre', ''.join(['drama'] * 2))
+            self.assertEqual({'x': 1}, storage[key])
+            self.assertTrue(42 in storage)
+            self.assertFalse('comedy' in storage)
+            self.assertRaises(KeyError, storage.__getitem__, 'comedy')
+            with self.assertRaises(TypeError):
+                storage['comedy'] = 1
+
+    def test_build_from_timed_storage(self):
+        source_path = os.path.join(self.temp_dir, 'source')
+        source = TimedStorage(source_path)
+        for i in range(100):
+            source['show %d' % i] = {'id': i}
+        source.close()
+
+        SnapshotStorage.build(self.file_path, source_path)
+        storage = SnapshotStorage(self.file_path)
+        self.assertTrue(storage.load())
+        self.assertEqual(100, len(storage))
+        self.assertEqual({'id': 57}, storage['show 57'])
+
+    def test_build_skips_expired(self):
+        source_path = os.path.join(self.temp_dir, 'source')
+        source = TimedStorage(source_path)
+        source['new'] = 1
+        source['old'] = 2
+        source._store['old'] = (2, time.time() - 100)
+        source.close()
+
+        self.assertEqual(1, SnapshotStorage.build(self.file_path, source_path,
+                                                  timedelta(seconds=10)))
+        storage = SnapshotStorage(self.file_path)
+        storage.load()
+        self.assertEqual(['new'], list(storage))
+        storage.close()
+
+        self.assertEqual(2, SnapshotStorage.build(self.file_path, source_path))
+
+    def test_empty(self):
+        SnapshotStorage.build(self.file_path, {})
+        storage = SnapshotStorage(self.file_path)
+        storage.load()
+        self.assertEqual({}, dict(storage))
+        self.assertFalse('a' in storage)
+
+    def test_load(self):
+        storage = SnapshotStorage(self.file_path)
+        self.assertFalse(storage.load())
+        PersistentStorage(self.file_path).close()
+        self.assertRaises(UnknownFormat, storage.load)
@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 import unittest
 
-from kodiswift import UrlRule
+from kodiswift import UrlRule, NotFoundException
+from kodiswift.urls import RouteTable
 
 
 class TestUrls(unittest.TestCase):
@@ -31,6 +32,25 @@ class TestUrls(unittest.TestCase):
         path_qs = rule.make_path_qs({'video_id': 24})
         self.assertEqual(path_qs, '/videos?video_id=24')
 
+    def test_make_path_qs_defaults(self):
+        def view(name, page):
+            return name, page
+
+        rule = UrlRule('/people/<name>/<page>', view, view.__name__,
+                       {'name': 'jon doe', 'page': '1', 'sort': 'asc'})
+        self.assertEqual(rule.make_path_qs({}), '/people/jon+doe/1')
+        self.assertEqual(rule.make_path_qs({'page': 2, 'limit': 10}),
+                         '/people/jon+doe/2?limit=10')
+        self.assertRaises(TypeError, rule.make_path_qs, {'name': ['jon']})
+
+    def test_make_path_qs_invalid_default(self):
+        def view(page):
+            return page
+
+        rule = UrlRule('/videos/<page>', view, view.__name__, {'page': 1})
+        self.assertRaises(TypeError, rule.make_path_qs, {})
+        self.assertEqual(rule.make_path_qs({'page': '2'}), '/videos/2')
+
 
 class TestUrlRule(unittest.TestCase):
     def test_match_without_trailing_slash(self):
@@ -46,3 +66,64 @@ class TestUrlRule(unittest.TestCase):
 
         rule = UrlRule('/videos', view, view.__name__, {})
         self.assertEqual((view, {}), rule.match('/videos/'))
+
+
+class TestRouteTable(unittest.TestCase):
+    def test_static_prefix(self):
+        def view():
+            pass
+
+        known_values = (
+            ('/', ()),
+            ('/videos/', ('videos',)),
+            ('/videos/all/<page>', ('videos', 'all')),
+            ('/<category>/videos', ()),
+            ('/page-<num>/', ()),
+            ('/a.b/', ()),
+        )
+        for url_rule, expected in known_values:
+            rule = UrlRule(url_rule, view, view.__name__, {})
+            self.assertEqual(expected, rule.static_prefix)
+
+    def test_match(self):
+        def videos():
+            pass
+
+        def video(video_id):
+            pass
+
+        def category(name):
+            pass
+
+        table = RouteTable([
+            UrlRule('/videos/', videos, 'videos', {}),
+            UrlRule('/videos/<video_id>', video, 'video', {}),
+            UrlRule('/<name>/', category, 'category', {}),
+        ])
+        self.assertEqual(3, len(table))
+        self.assertEqual((videos, {}), table.match('/videos'))
+        self.assertEqual((video, {'video_id': '42'}),
+                         table.match('/videos/42'))
+        self.assertEqual((category, {'name': 'movies'}),
+                         table.match('/movies/'))
+        self.assertRaises(NotFoundException, table.match, '/')
+        self.assertRaises(NotFoundException, table.match, '/movies/42/')
+
+    def test_first_registered_wins(self):
+        def first(name):
+            pass
+
+        def second():
+            pass
+
+        table = RouteTable()
+        table.add(UrlRule('/<name>/', first, 'first', {}))
+        table.add(UrlRule('/videos/', second, 'second', {}))
+        self.assertEqual((first, {'name': 'videos'}), table.match('/videos/'))
+
+    def test_regex_characters_are_not_static(self):
+        def view():
+            pass
+
+        table = RouteTable([UrlRule('/a.b/', view, 'view', {})])
+        self.assertEqual((view, {}), table.match('/axb/'))
@@ -1,14 +1,18 @@
 # -*- coding: utf-8 -*-
 import os
 import tempfile
+import threading
+import time
 import unittest
 
-from mock import Mock, patch, call
+from mock import ANY, Mock, patch, call
 
 import kodiswift
 from kodiswift import SortMethod
 from kodiswift import xbmc
+from kodiswift.common import cache_key
 from kodiswift.listitem import ListItem
+from kodiswift.storage import SnapshotStorage, SQLiteStorage, TimedStorage
 from kodiswift.xbmcmixin import XBMCMixin
 
 
@@ -44,6 +48,28 @@ class TestXBMCMixin(unittest.TestCase):
         cache = self.m.get_storage('animals')
         self.assertEqual(cache['dog'], 'woof')
 
+    def test_get_storage_sqlite(self):
+        cache = self.m.get_storage('sqlite_animals', file_format='sqlite')
+        self.assertTrue(isinstance(cache, SQLiteStorage))
+        cache['dog'] = 'woof'
+        cache.close()
+
+        # The format of an existing storage is detected from the file
+        cache = TestMixedIn().get_storage('sqlite_animals')
+        self.assertTrue(isinstance(cache, SQLiteStorage))
+        self.assertEqual(cache['dog'], 'woof')
+        cache.clear()
+        cache.close()
+
+    def test_get_storage_snapshot(self):
+        path = os.path.join(self.m.storage_path, 'snapshot_animals')
+        SnapshotStorage.build(path, {'dog': 'woof'})
+        cache = self.m.get_storage('snapshot_animals')
+        self.assertTrue(isinstance(cache, SnapshotStorage))
+        self.assertEqual(cache['dog'], 'woof')
+        cache.close()
+        os.remove(path)
+
     def test_get_string(self):
         self.m.addon.getLocalizedString.return_value = 'Hello Kodi'
         self.assertEqual('Hello Kodi', self.m.get_string('30000'))
@@ -212,11 +238,442 @@ class TestXBMCMixin(unittest.TestCase):
         plugin.clear_function_cache()
         self.assertEqual(len(storage.items()), 0)
 
+    def test_cached_memo(self):
+        plugin = MixedIn(storage_path=tempfile.mkdtemp(), memo_size=2)
+        calls = []
+
+        @plugin.cached(ttl=1)
+        def echo(msg, suffix=''):
+            calls.append(msg)
+            return msg + suffix
+
+        echo('a')
+        storage = plugin.get_storage('.functions')
+        with patch.object(storage, 'entry', wraps=storage.entry) as entry:
+            self.assertEqual('a', echo('a'))
+            self.assertEqual('a!', echo('a', suffix='!'))
+            self.assertEqual(['a', 'a'], calls)
+            self.assertEqual('a!', echo('a', suffix='!'))
+            # Memoized results don't touch the storage
+            self.assertEqual(1, entry.call_count)
+
+        # Unhashable arguments are only cached in the storage
+        self.assertEqual([1], echo([1], suffix=[]))
+        self.assertEqual([1], echo([1], suffix=[]))
+        self.assertEqual(3, len(calls))
+
+        # The oldest results are evicted, and expired ones aren't served
+        echo('b')
+        echo('c')
+        memo = plugin._function_memo('.functions')
+        self.assertEqual(2, len(memo))
+        for memo_key, (result, _) in memo.items():
+            memo[memo_key] = (result, time.time() - 1)
+        storage.clear()
+        echo('c')
+        self.assertEqual(['a', 'a', [1], 'b', 'c', 'c'], calls)
+
+        plugin.clear_function_cache()
+        self.assertEqual(0, len(plugin._function_memo('.functions')))
+
+    def test_cached_namespaces(self):
+        plugin = MixedIn(storage_path=tempfile.mkdtemp())
+
+        @plugin.cached(namespace='shows')
+        def shows(genre):
+            return [genre]
+
+        @plugin.cached(namespace='shows')
+        def show(show_id):
+            return show_id
+
+        @plugin.cached(namespace=True)
+        def episodes(show_id):
+            return [show_id]
+
+        @plugin.cached()
+        def echo(msg):
+            return msg
+
+        # Nothing is loaded until the functions are called
+        self.assertEqual([], plugin.function_cache_namespaces())
+        shows('drama')
+        show(1)
+        episodes(1)
+        echo('hello')
+        own = 'tests.test_xbmcmixin.episodes'
+        self.assertEqual([None, 'shows', own],
+                         plugin.function_cache_namespaces())
+        self.assertTrue(os.path.exists(
+            os.path.join(plugin.storage_path, '.functions.shows')))
+
+        sizes = plugin.function_cache_sizes()
+        self.assertEqual(2, sizes['shows'][0])
+        self.assertEqual(1, sizes[own][0])
+        self.assertTrue(sizes[None][1] > 0)
+
+        plugin.clear_function_cache('shows')
+        sizes = plugin.function_cache_sizes()
+        self.assertEqual(0, sizes['shows'][0])
+        self.assertEqual(1, sizes[own][0])
+        plugin.clear_function_cache()
+        self.assertEqual(set([0]), set(
+            entries for entries, _ in plugin.function_cache_sizes().values()))
+
+    def test_cached_syncs_on_miss(self):
+        plugin = MixedIn(storage_path=tempfile.mkdtemp())
+
+        @plugin.cached()
+        def echo(msg):
+            return msg
+
+        echo('hello')
+        echo('hello')
+        storage = plugin.get_storage('.functions')
+        self.assertFalse(storage.dirty)
+        self.assertEqual(1, storage.writes)
+
+    def test_cached_write_behind(self):
+        plugin = MixedIn(
+            storage_path=tempfile.mkdtemp(), addon=Mock(), added_items=[],
+            request=Mock(), info_type='pictures', handle=0,
+            _end_of_directory=False)
+
+        @plugin.cached(write_behind=True)
+        def echo(msg):
+            return msg
+
+        storage = plugin.get_storage('.functions')
+        echo('hello')
+        self.assertTrue(storage.dirty)
+        self.assertEqual(0, storage.writes)
+
+        def end_of_directory(*args):
+            # The listing is handed to Kodi before the cache is synced
+            self.assertEqual(0, storage.writes)
+
+        with patch('kodiswift.xbmcplugin.endOfDirectory',
+                   side_effect=end_of_directory):
+            plugin.finish([{'label': echo('hello')}])
+        self.assertFalse(storage.dirty)
+        self.assertEqual(1, storage.writes)
+
+    def test_cached_stale(self):
+        plugin = MixedIn(
+            storage_path=tempfile.mkdtemp(), addon=Mock(), added_items=[],
+            request=Mock(), info_type='pictures', handle=0,
+            _end_of_directory=False)
+        # Entries are aged in the storage, behind the back of the memo
+        plugin.memo_size = 0
+        calls = []
+
+        @plugin.cached(ttl=1, stale_ttl=10)
+        def scrape():
+            calls.append(1)
+            return len(calls)
+
+        storage = plugin.get_storage('.functions')
+        self.assertEqual(1, scrape())
+        key, = storage.keys()
+        storage._store[key] = (1, time.time() - 120)
+
+        def end_of_directory(*args):
+            # The stale result is served and only refreshed afterwards
+            self.assertEqual(1, len(calls))
+
+        self.assertEqual(1, scrape())
+        self.assertEqual(1, scrape())
+        with patch('kodiswift.xbmcplugin.endOfDirectory',
+                   side_effect=end_of_directory):
+            plugin.finish([])
+        plugin._join_refreshes()
+        self.assertEqual(2, len(calls))
+        self.assertEqual(2, storage[key])
+        self.assertEqual(2, scrape())
+
+        # Past the stale window the result is computed right away
+        storage._store[key] = (2, time.time() - 12 * 60)
+        self.assertEqual(3, scrape())
+
+    @patch('kodiswift.xbmcplugin.setContent')
+    @patch('kodiswift.xbmcplugin.addDirectoryItems')
+    @patch('kodiswift.xbmcplugin.endOfDirectory')
+    def test_cached_stale_finish(self, end_of_directory, add_directory_items,
+                                 set_content):
+        plugin = MixedIn(
+            storage_path=tempfile.mkdtemp(), addon=Mock(), added_items=[],
+            request=Mock(), info_type='pictures', handle=0,
+            _end_of_directory=False)
+        plugin.memo_size = 0
+        labels = iter(['old', 'new'])
+
+        # A view which hands its listing to Kodi itself
+        @plugin.cached(ttl=1, stale_ttl=10)
+        def view():
+            plugin.set_content('movies')
+            return plugin.finish([{'label': next(labels)}])
+
+        storage = plugin.get_storage('.functions')
+        view()
+        key, = storage.keys()
+        storage._store[key] = (storage[key], time.time() - 120)
+        self.assertEqual(1, end_of_directory.call_count)
+
+        plugin._end_of_directory = False
+        self.assertEqual(['old'], [item.label for item in view()])
+        with patch('kodiswift.xbmcmixin.log') as log:
+            plugin._join_refreshes()
+        self.assertFalse(log.exception.called)
+        self.assertEqual(['new'], [item.label for item in storage[key]])
+        self.assertEqual(1, end_of_directory.call_count)
+        self.assertEqual(1, add_directory_items.call_count)
+        self.assertEqual(1, set_content.call_count)
+
+    def test_cached_stale_no_ttl(self):
+        plugin = MixedIn(storage_path=tempfile.mkdtemp())
+        plugin.memo_size = 0
+        calls = []
+
+        @plugin.cached(ttl=0, stale_ttl=10)
+        def scrape():
+            calls.append(1)
+            return len(calls)
+
+        self.assertEqual(1, scrape())
+        storage = plugin.get_storage('.functions')
+        self.assertIsNone(storage.ttl)
+        key, = storage.keys()
+        storage._store[key] = (1, time.time() - 365 * 24 * 60 * 60)
+        self.assertEqual(1, scrape())
+        self.assertFalse(getattr(plugin, '_refreshes', None))
+        self.assertEqual(1, len(calls))
+
+    def test_cached_falsy_ttl(self):
+        for ttl in (None, 0):
+            for memo_size in (0, 256):
+                plugin = MixedIn(storage_path=tempfile.mkdtemp())
+                plugin.memo_size = memo_size
+                calls = []
+
+                @plugin.cached(ttl=ttl)
+                def scrape(show_id):
+                    calls.append(show_id)
+                    return show_id
+
+                self.assertEqual('drama', scrape('drama'))
+                storage = plugin.get_storage('.functions')
+                key, = storage.keys()
+                storage._store[key] = ('drama', time.time() - 10 ** 8)
+                self.assertEqual('drama', scrape('drama'))
+                self.assertEqual(['drama'], calls)
+
+    def test_cached_max_entries(self):
+        plugin = MixedIn(storage_path=tempfile.mkdtemp())
+        plugin.memo_size = 0
+        plugin.function_cache_max_entries = 2
+        calls = []
+
+        @plugin.cached()
+        def scrape(show_id):
+            calls.append(show_id)
+            return show_id
+
+        for show_id in ('drama', 'comedy', 'news'):
+            scrape(show_id)
+        storage = plugin.get_storage('.functions')
+        self.assertEqual(2, storage.max_entries)
+        self.assertEqual(2, len(storage))
+        scrape('news')
+        scrape('drama')
+        self.assertEqual(['drama', 'comedy', 'news', 'drama'], calls)
+
+    def test_cached_max_bytes(self):
+        plugin = MixedIn(storage_path=tempfile.mkdtemp())
+        plugin.memo_size = 0
+
+        @plugin.cached(namespace='pages', max_bytes=1500)
+        def page(number):
+            return 'x' * 1000
+
+        page(1)
+        page(2)
+        storage = plugin.get_storage('.functions.pages')
+        self.assertEqual(1500, storage.max_bytes)
+        self.assertEqual(1, len(storage))
+
+    def test_cached_skips_mutation_checks(self):
+        plugin = MixedIn(storage_path=tempfile.mkdtemp())
+        plugin.memo_size = 0
+
+        @plugin.cached()
+        def episodes(show_id):
+            return [{'label': show_id}]
+
+        episodes('drama')
+        episodes('drama')
+        storage = plugin.get_storage('.functions')
+        self.assertFalse(storage.track_mutations)
+        self.assertEqual({}, storage._snapshots)
+        with patch('kodiswift.storage.pickle.dumps') as dumps:
+            self.assertFalse(storage.dirty)
+        self.assertFalse(dumps.called)
+
+    def test_cached_stale_calls_cached(self):
+        storage_path = tempfile.mkdtemp()
+        plugin = MixedIn(storage_path=storage_path)
+        plugin.memo_size = 0
+        calls = []
+
+        @plugin.cached()
+        def fetch(show_id, version):
+            time.sleep(0.001)
+            return version
+
+        @plugin.cached(ttl=1, stale_ttl=10)
+        def show(show_id):
+            calls.append(show_id)
+            return fetch(show_id, len(calls))
+
+        storage = plugin.get_storage('.functions')
+        self.assertEqual(range(1, 7), [show(i) for i in range(6)])
+        for key, (value, timestamp) in storage._store.items():
+            storage._store[key] = (value, timestamp - 120)
+        self.assertEqual(range(1, 7), [show(i) for i in range(6)])
+
+        with patch('threading.Thread', wraps=threading.Thread) as thread:
+            plugin._start_refreshes()
+            # The main thread keeps missing while the refreshes run
+            for i in range(20):
+                fetch('main', i)
+            plugin._join_refreshes()
+        self.assertEqual(1, thread.call_count)
+
+        self.assertEqual(12, len(calls))
+        self.assertEqual(range(7, 13), sorted(show(i) for i in range(6)))
+        loaded = TimedStorage(os.path.join(storage_path, '.functions'))
+        loaded.load()
+        self.assertEqual(dict(storage.items()), dict(loaded.items()))
+
+    def test_cached_keys(self):
+        plugin = MixedIn(storage_path=tempfile.mkdtemp())
+        calls = []
+
+        @plugin.cached(exclude=['session'])
+        def fetch(session, url, params=None):
+            calls.append(url)
+            return url
+
+        fetch(object(), '/a', params={'x': 1, 'y': 2})
+        fetch(object(), '/a', params={'y': 2, 'x': 1})
+        fetch(object(), '/b')
+        self.assertEqual(['/a', '/b'], calls)
+        storage = plugin.get_storage('.functions')
+        self.assertTrue(all(len(key) == 40 for key in storage.keys()))
+
+        @plugin.cached(key_func=lambda function, args, kwargs: args[0])
+        def double(x):
+            return 2 * x
+
+        self.assertEqual(4, double(2))
+        self.assertEqual(4, storage[2])
+
+    @staticmethod
+    def _coalescing_plugin():
+        return MixedIn(
+            storage_path=tempfile.mkdtemp(), addon=Mock(), added_items=[],
+            request=Mock(), info_type='pictures', handle=0,
+            _end_of_directory=False, coalesce=True)
+
+    @staticmethod
+    def _hold_inflight(plugin, function, *args):
+        """Marks a key as being computed by another process."""
+        key = cache_key(function, args, {})
+        lock_path = plugin._inflight_path(key)
+        open(lock_path, 'w').close()
+        return key, lock_path
+
+    def test_cached_coalesce(self):
+        plugin = self._coalescing_plugin()
+        calls = []
+
+        @plugin.cached()
+        def scrape(genre):
+            calls.append(genre)
+            return 'mine'
+
+        key, lock_path = self._hold_inflight(plugin, scrape, 'drama')
+
+        def other_process():
+            time.sleep(0.1)
+            storage = TimedStorage(
+                os.path.join(plugin.storage_path, '.functions'))
+            storage.load()
+            storage[key] = 'theirs'
+            storage.close()
+            os.remove(lock_path)
+
+        thread = threading.Thread(target=other_process)
+        thread.start()
+        self.assertEqual('theirs', scrape('drama'))
+        thread.join()
+        self.assertEqual([], calls)
+        self.assertEqual(1, plugin.coalesced_calls)
+
+    def test_cached_coalesce_rereads(self):
+        plugin = self._coalescing_plugin()
+        calls = []
+
+        @plugin.cached()
+        def scrape(genre):
+            calls.append(genre)
+            return 'mine'
+
+        scrape('comedy')
+        # Cached by another process after this one loaded the storage
+        storage = TimedStorage(os.path.join(plugin.storage_path, '.functions'))
+        storage.load()
+        storage[cache_key(scrape, ('drama',), {})] = 'theirs'
+        storage.close()
+
+        self.assertEqual('theirs', scrape('drama'))
+        self.assertEqual(['comedy'], calls)
+        self.assertEqual(1, plugin.coalesced_calls)
+
+    def test_inflight_path_equal_keys(self):
+        plugin = self._coalescing_plugin()
+        # Equal to the first key, but made of two distinct strings
+        self.assertEqual(
+            plugin._inflight_path(('drama', 'drama')),
+            plugin._inflight_path((''.join(['dra', 'ma']),
+                                   ''.join(['dr', 'ama']))))
+
+    def test_cached_coalesce_timeout(self):
+        plugin = self._coalescing_plugin()
+        plugin.coalesce_timeout = 0.1
+
+        @plugin.cached()
+        def scrape(genre):
+            return 'mine'
+
+        _, lock_path = self._hold_inflight(plugin, scrape, 'drama')
+
+        self.assertEqual('mine', scrape('drama'))
+        self.assertEqual(1, plugin.coalesce_timeouts)
+
+        # A lock left by a process which died is taken over
+        plugin.coalesce_timeout = 60
+        os.utime(lock_path, (time.time() - 120, time.time() - 120))
+        self.assertEqual('mine', scrape('comedy'))
+        plugin.clear_function_cache()
+        self.assertEqual('mine', scrape('drama'))
+        self.assertFalse(os.path.exists(lock_path))
+        self.assertEqual(0, plugin.coalesced_calls)
+
 
 class TestAddItems(unittest.TestCase):
-    @patch('kodiswift.ListItem.from_dict')
+    @patch.object(ListItem, 'from_dicts', wraps=ListItem.from_dicts)
     @patch('kodiswift.xbmcplugin.addDirectoryItems')
-    def test_add_items(self, add_dir_items, from_dict):
+    def test_add_items(self, add_dir_items, from_dicts):
         plugin = MixedIn(storage_path=tempfile.mkdtemp(), addon=Mock(),
                          added_items=[], request=Mock(), info_type='pictures',
                          handle=0)
@@ -224,25 +681,17 @@ class TestAddItems(unittest.TestCase):
             {'label': 'Course 1', 'path': 'plugin.image.test/foo'},
             {'label': 'Course 2', 'path': 'plugin.image.test/bar'},
         ]
-        plugin.add_items(items)
-
-        # TODO: Assert actual arguments passed to the addDirectoryItems call
-        self.assertTrue(add_dir_items.called)
-        calls = [
-            call(label='Course 1', path='plugin.image.test/foo',
-                 info_type='pictures'),
-            call(label='Course 2', path='plugin.image.test/bar',
-                 info_type='pictures'),
-        ]
-        from_dict.assert_has_calls(calls)
+        returned = plugin.add_items(items)
 
-        # TODO: Currently ListItems don't implement __eq__
-        # list_items = [ListItem.from_dict(**item) for item in items]
-        # self.assertEqual(returned, list_items)
+        from_dicts.assert_called_once_with(items, 'pictures')
+        tuples = [item.as_tuple() for item in returned]
+        add_dir_items.assert_called_once_with(0, tuples, 2)
+        self.assertEqual(returned, [ListItem.from_dict(**item)
+                                    for item in items])
 
-    @patch('kodiswift.ListItem.from_dict')
+    @patch.object(ListItem, 'from_dicts', wraps=ListItem.from_dicts)
     @patch('kodiswift.xbmcplugin.addDirectoryItems')
-    def test_add_items_no_info_type(self, add_directory_items, from_dict):
+    def test_add_items_no_info_type(self, add_directory_items, from_dicts):
         plugin = MixedIn(storage_path=tempfile.mkdtemp(), addon=Mock(),
                          added_items=[], request=Mock(), handle=0)
         items = [
@@ -251,39 +700,83 @@ class TestAddItems(unittest.TestCase):
         results = plugin.add_items(items)
 
         self.assertTrue(add_directory_items.called)
-        calls = [
-            call(label='Course 1', path='plugin.image.test/foo',
-                 info_type='video'),
-        ]
-        from_dict.assert_has_calls(calls)
+        from_dicts.assert_called_once_with(items, 'video')
 
         list_items = [ListItem.from_dict(**item) for item in items]
         self.assertEqual(results, list_items)
 
-    @patch('kodiswift.ListItem.from_dict')
+    @patch('kodiswift.xbmcgui.ListItem.setInfo')
     @patch('kodiswift.xbmcplugin.addDirectoryItems')
     def test_add_items_item_specific_info_type(self, add_directory_items,
-                                               from_dict):
+                                               set_info):
         plugin = MixedIn(
             storage_path=tempfile.mkdtemp(), addon=Mock(), added_items=[],
             request=Mock(), handle=0, info_type='pictures')
         items = [
             {'label': 'Course 1', 'path': 'plugin.image.test/foo',
-             'info_type': 'music'}
+             'info': {'title': 'Course 1'}, 'info_type': 'music'}
         ]
         results = plugin.add_items(items)
 
         self.assertTrue(add_directory_items.called)
-        calls = [
-            call(label='Course 1', path='plugin.image.test/foo',
-                 info_type='music'),
-        ]
-        from_dict.assert_has_calls(calls)
+        set_info.assert_called_once_with('music', {'title': 'Course 1'})
 
         list_items = [ListItem.from_dict(**item) for item in items]
         self.assertEqual(results, list_items)
 
 
+    @patch('kodiswift.xbmcplugin.addDirectoryItems')
+    def test_add_items_generator(self, add_directory_items):
+        plugin = MixedIn(storage_path=tempfile.mkdtemp(), addon=Mock(),
+                         added_items=[], request=Mock(), handle=0)
+        plugin.add_items_chunk_size = 2
+
+        def pages():
+            for i in range(5):
+                # Each chunk is handed to Kodi before the next is fetched
+                self.assertEqual(i // 2, add_directory_items.call_count)
+                yield {'label': 'Course %d' % i}
+
+        results = plugin.add_items(pages(), total_items=5)
+
+        self.assertEqual(['Course %d' % i for i in range(5)],
+                         [item.label for item in results])
+        calls = add_directory_items.call_args_list
+        self.assertEqual([2, 2, 1], [len(c[0][1]) for c in calls])
+        self.assertEqual([5, 5, 5], [c[0][2] for c in calls])
+
+        add_directory_items.reset_mock()
+        plugin.add_items(iter([{'label': 'Course 5'}]))
+        add_directory_items.assert_called_once_with(0, ANY, 0)
+
+    @patch('kodiswift.xbmcplugin.addDirectoryItems')
+    def test_max_added_items(self, add_directory_items):
+        plugin = MixedIn(storage_path=tempfile.mkdtemp(), addon=Mock(),
+                         added_items=[], request=Mock(), handle=0)
+        plugin.add_items_chunk_size = 2
+        plugin.max_added_items = 3
+
+        items = ({'label': 'Course %d' % i} for i in range(5))
+        results = plugin.add_items(items)
+        self.assertEqual(5, len(results))
+        self.assertEqual(5, sum(len(c[0][1]) for c in
+                                add_directory_items.call_args_list))
+
+        results = plugin.add_items([{'label': 'Course 5'}])
+        self.assertEqual(['Course 5'], [item.label for item in results])
+        self.assertEqual(['Course 0', 'Course 1', 'Course 2'],
+                         [item.label for item in plugin.added_items])
+
+        # Kept nothing, as with keep_added_items=False inside Kodi
+        plugin.max_added_items = 0
+        plugin.added_items = []
+        results = plugin.add_items([{'label': 'Course %d' % i}
+                                    for i in range(60)])
+        self.assertEqual(60, len(results))
+        self.assertEqual([], plugin.added_items)
+        self.assertEqual(60, len(add_directory_items.call_args[0][1]))
+
+
 class TestAddToPlaylist(unittest.TestCase):
     def setUp(self):
         with patch('kodiswift.xbmc.Playlist') as playlist: